@@ -1,14 +1,17 @@
 from process import AIProcess
 
 import game
+import pathfinding
+import tracing
 import sys
 import time
 import datetime
-import heapq
+from timeit import default_timer as clock
 import pygame
 from random import randint
 
 VISUALIZE = False
+VISIT_COLORS = (pygame.Color(100, 100, 100), pygame.Color(55, 55, 55))  # Open, closed
 DEBUG = False
 
 DIRECTION_SET = {}
@@ -19,51 +22,33 @@ DIRECTION_SET[game.DOWN]  = [(-1,0,game.LEFT),(1,0,game.RIGHT),(0,1,game.DOWN)]
 
 
 class Node(object):
-    def __init__(self, x, y, direction, cost=0, hcost=0, fcost=0):
-        self.parent = None
+    __slots__ = ('x', 'y', 'direction')
+
+    def __init__(self, x, y, direction):
         self.x = x
         self.y = y
-        self.cost  = cost
-        self.hcost = hcost
-        self.fcost = fcost
         self.direction = direction
-        self.rect = pygame.Rect(self.x*game.CELL_WIDTH, self.y*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT)
-
-    def __gt__(self, other):
-        if self.fcost == other.fcost:
-            return self.hcost > other.hcost
-        return self.fcost > other.fcost
-
-    def __lt__(self, other):
-        if self.fcost == other.fcost:
-            return self.hcost < other.hcost
-        return self.fcost < other.fcost
 
     def __eq__(self, other):
         return self.x == other.x and self.y == other.y
 
     def __hash__(self):
-        return int('9%d%d' % (self.x, self.y))
+        return self.x*game.BOARD_HEIGHT + self.y
 
     def __repr__(self):
-        return '(%d %d %d, %d + %d = %d)' % (self.x, self.y, self.direction, self.cost, self.host, self.fcost)
-
-    def distance(self, other):
-        dt_x = abs(other.x - self.x)
-        dt_y = abs(other.y - self.y)
-        return min(dt_x, game.BOARD_WIDTH - dt_x) + min(dt_y, game.BOARD_HEIGHT - dt_y)
-
-    def draw(self, color):
-        if VISUALIZE:
-            pygame.draw.rect(game.screen, color, self.rect)
-
-def heuristic_cost_estimate( node1, node2 ):
-    return node1.distance(node2) * 8
+        return '(%d %d %d)' % (self.x, self.y, self.direction)
 
 class JameelAI(AIProcess):
 
     def __init__(self, player, *args, **kwargs):
         super(JameelAI, self).__init__(*args, **kwargs)
+        self.grid = pathfinding.get_grid(game.BOARD_WIDTH, game.BOARD_HEIGHT)
+        # Snakes can't turn back, so cells are left in the directions of
+        # DIRECTION_SET, depending on how they were entered
+        self.path_finder = pathfinding.PathFinder(self.grid,
+                [[d for _x, _y, d in DIRECTION_SET[direction]] for direction in pathfinding.DIRECTIONS])
+        if VISUALIZE:
+            self.path_finder.on_visit = self.draw_visit
         self.last_known_position = None
         self.previous_move = None
         self.update_position()
@@ -82,117 +67,59 @@ class JameelAI(AIProcess):
         dt_y = abs(coordinates1[1] - coordinates2[1])
         return min(dt_x, game.BOARD_WIDTH-dt_x) + min(dt_y, game.BOARD_HEIGHT-dt_y)
 
-    def neighbor_nodes(self, x, y, direction):
-        def is_okay(x, y):
-            return self.board[x][y] not in ('W', 'S', 'M', "I")
-        for (_x, _y, _direction) in DIRECTION_SET[direction]:
-            _x, _y = self.adjust_coordinates( x+_x, y+_y )
-            if is_okay(_x, _y):
-                yield Node(_x, _y, _direction)
-
     def closest_apple(self, x, y):
         return min([(self.calculate_distance((x,y), (apple.x,apple.y)), apple) for apple in self.apples])[1]
 
     def closest_player(self, x, y):
         min([(self.calculate_distance((player.x, player.y), (x, y)), player) for player in self._players if player != self.player ])[1]
 
-    def get_real_neighbor(self, openset, neighbor):
-        try:
-            real_neighbor = [ n for n in openset if n == neighbor ][0]
-            return real_neighbor
-        except IndexError:
-            return neighbor
-
-
-    def reconstruct_path(self, current):
-        astar_path = []     
-        currentNode = current
-        astar_path.append((currentNode.x, currentNode.y, currentNode.direction))
-        while currentNode.parent != None:
-            currentNode = currentNode.parent
-            astar_path.append((currentNode.x, currentNode.y, currentNode.direction))
-        astar_path.pop()
-        astar_path.reverse()
-        return astar_path
-
     def astar(self, goal):
-
+        """ Returns the steps to _goal_ as (x, y, direction), or None. The
+            goal moves to any apple found on the way. """
         self._goal = goal
-
-        def is_apple(node):
-            return self.board[node.x][node.y] == 'A'
-
-        start = Node(self.player.x, self.player.y, self.player.direction)
-        
-        openset   = [start]
-        closedset = set()
-
-        start.cost  = 0
-        start.hcost = goal.distance(start)
-        start.fcost = start.cost + start.hcost
-    
-        start = time.time()
-
-        while openset:
-            current = heapq.heappop(openset)
-            
-            #if is_apple(current):
-            #   goal = current
-
-            if current == goal:
-                return self.reconstruct_path(current)
-
-            closedset.add(current)
-            current.draw(pygame.Color(55, 55, 55))
-
-            for neighbor in self.neighbor_nodes(current.x, current.y, current.direction):
-
-                if self.time_passed() > 95000: #150000: 
-                    break
-
-                if is_apple(neighbor):
-                    goal = neighbor
-                    self._goal = goal
-
-                tentative_cost  = current.cost + current.distance(neighbor)
-                tentative_hcost = heuristic_cost_estimate(goal, neighbor)
-                tentative_fcost = tentative_cost + tentative_hcost
-                
-                if neighbor in closedset and tentative_fcost >= neighbor.fcost:
-                    continue
-
-                neighbor_not_in_openset = neighbor not in openset
-                if neighbor_not_in_openset or tentative_fcost < neighbor.fcost:
-                    neighbor.parent    = current
-                    neighbor.cost      = tentative_cost
-                    neighbor.hcost     = tentative_hcost
-                    neighbor.fcost     = tentative_cost + tentative_hcost
-
-                    neighbor.direction = neighbor.direction
-                    if neighbor_not_in_openset:
-                        heapq.heappush(openset, neighbor)
-                        neighbor.draw(pygame.Color(100, 100, 100))
-                '''
-                real_neighbor = self.get_real_neighbor(openset, neighbor)
-                tentative_cost  = current.cost + current.distance(neighbor)
-                tentative_hcost = heuristic_cost_estimate(goal, neighbor)
-                tentative_fcost = tentative_cost + tentative_hcost
-                if neighbor in closedset and tentative_fcost >= real_neighbor.fcost:
-                    continue
-                neighbor_not_in_openset = neighbor not in openset
-                if neighbor_not_in_openset or tentative_fcost < real_neighbor.fcost:
-                    real_neighbor.parent    = current
-                    real_neighbor.cost      = tentative_cost
-                    real_neighbor.hcost     = tentative_hcost
-                    neighbor.fcost          = tentative_cost + tentative_hcost
-                    real_neighbor.direction = neighbor.direction
-                    if neighbor_not_in_openset:
-                        heapq.heappush(openset, real_neighbor)
-                        real_neighbor.draw(pygame.Color(100, 100, 100))
-                '''
-                
-            if VISUALIZE:
-                pygame.display.flip()
+        grid = self.grid
+        start = grid.index(self.player.x, self.player.y)
+        goal_cell = grid.index(goal.x, goal.y)
+        is_apple = (self.board.ravel() == game.APPLE).tolist()
+        distance = grid.distance
+        deadline = clock() + (95000 - self.time_passed()) / 1e6
+
+        path = self.path_finder.find(start, goal_cell, grid.blocked(self.board),
+                lambda cell, goal: distance(goal, cell) * 8,
+                direction=self.player.direction, start_h=distance(goal_cell, start),
+                retarget=is_apple.__getitem__, deadline=deadline)
+        self.nodes_expanded = self.path_finder.nodes_expanded
+        if self.path_finder.goal != goal_cell:
+            x, y = grid.coordinates(self.path_finder.goal)
+            self._goal = Node(x, y, self.path_finder.entered[self.path_finder.goal])
+        if VISUALIZE:
+            pygame.display.flip()
+        if path is None:
+            return None
+        return [grid.coordinates(cell) + (self.path_finder.entered[cell],) for cell in path]
+
+    def apple_descent(self):
+        """ Returns the steps down the apple distance field to the closest
+            apple as (x, y, direction), or None if there are none that don't
+            turn back. """
+        if self.apple_distances is None:
+            return None
+        grid = self.grid
+        start = grid.index(self.player.x, self.player.y)
+        behind = grid.neighbor(start, pathfinding.OPPOSITE_DIRECTIONS[self.player.direction])
+        cells = grid.descend(self.apple_distances.get(), start, behind)
+        if cells is None:
+            return None
+        path = []
+        previous = start
+        for cell in cells:
+            path.append(grid.coordinates(cell) + (grid.direction(previous, cell),))
+            previous = cell
+        self._goal = Node(*path[-1])
+        return path
+
+    def draw_visit(self, cell, is_closed):
+        pygame.draw.rect(game.screen, VISIT_COLORS[is_closed], self.grid.rect(cell))
 
     def opponent_ahead(self, next_direction):
         if next_direction != self.player.direction:
@@ -246,7 +173,7 @@ class JameelAI(AIProcess):
                 '''
             if self.missile_will_strike(x, y):
                 return False
-            return self.board[x][y] not in ('W', 'S', 'M', "I")
+            return self.board[x, y] not in game.OBSTACLES
 
         modes = [True, False]
         if direction == game.UP:
@@ -257,9 +184,9 @@ class JameelAI(AIProcess):
             x,y = self.adjust_coordinates( self.player.x-1, self.player.y )
         elif direction == game.RIGHT:   
             x,y = self.adjust_coordinates( self.player.x+1, self.player.y )
-        if DEBUG: print '+%d:' % self.player_index, "current:", (self.player.x, self.player.y), "error(x,y,direction)=", (x,y,direction), "board=[", self.board[x][y], "],", is_okay(x,y)
+        if DEBUG: print '+%d:' % self.player_index, "current:", (self.player.x, self.player.y), "error(x,y,direction)=", (x,y,direction), "board=[", self.board[x, y], "],", is_okay(x,y)
         if is_okay(x,y,True) == False:
-            if DEBUG: print '+%d:' % self.player_index, "run Into Something [", self.board[x][y], "] current direction:", self.player.direction, "should direction:", direction
+            if DEBUG: print '+%d:' % self.player_index, "run Into Something [", self.board[x, y], "] current direction:", self.player.direction, "should direction:", direction
             for (_x, _y, _direction) in DIRECTION_SET[self.player.direction]:
                 _x, _y = self.adjust_coordinates( self.player.x+_x, self.player.y+_y )
                 for mode in modes:
@@ -290,16 +217,17 @@ class JameelAI(AIProcess):
         
         #print self.player_positions, (self.player.x, self.player.y, self.player.direction), self.player_index
         
-        goal = self.closest_apple(self.player.x, self.player.y)
-        goal = Node(goal.x, goal.y, -1)
-        
         if not self._path:
-            self._path = self.astar(goal)
+            self._path = self.apple_descent()
+            if not self._path:
+                goal = self.closest_apple(self.player.x, self.player.y)
+                goal = Node(goal.x, goal.y, -1)
+                self._path = tracing.traced_search(self, self.astar, goal)
         else:
             if self.previous_move != None and self.previous_move != (self.player.x, self.player.y, self.player.direction):
                 self._path = []
                 self.previous_move = None
-            if self._goal != None and self.board[self._goal.x][self._goal.y] != 'A':
+            if self._goal != None and self.board[self._goal.x, self._goal.y] != game.APPLE:
                 self._path = []
                 self.previous_move = None
 
@@ -1,5 +1,4 @@
 from collections import deque
-from heapq import heappush, heappop
 from operator import itemgetter
 
 import pygame
@@ -7,124 +6,68 @@ from pygame.locals import *
 
 import game
 import game_objects
+import pathfinding
+import tracing
 
 class AStar(object):
     def __init__(self):
-        self.closed_set = set()
-        self.open_set = set()  # We use set for fast membership tests
-        self.open_heap = []  # We use heap for fast min checks
-        self.nodes = {}
+        self.grid = pathfinding.get_grid(game.BOARD_WIDTH, game.BOARD_HEIGHT)
+        self.path_finder = pathfinding.PathFinder(self.grid, break_ties_by_cell=True, improve_open=True)
+        self.nodes_expanded = 0
 
         self.enable_path_visualization = False
-        self.wrap_coordinates = False
         self.retarget_alternate_goals = False
 
-    def is_neighbor(self, node):
+    def blocked_cells(self):
+        """Returns for each cell whether paths can't go through it."""
         raise Exception("Not implemented")
 
-    def is_alternate_goal(self, node):
-        raise Exception("Not implemented")
-
-    def wrap_node(self, node):
+    def alternate_goal_cells(self):
+        """Returns for each cell whether it would do as well as the goal."""
         raise Exception("Not implemented")
 
     def draw_node(self, node, color):
         raise Exception("Not implemented")
 
-    def movement_cost(self, node1, node2):
-        raise Exception("Not implemented")
-
-    def heuristic_estimate_cost(self, start, goal):
-        raise Exception("Not implemented")
+    def visit_cell(self, cell, is_closed):
+        # Draw the closed and open sets
+        self.draw_node(self.grid.coordinates(cell), pygame.Color("green" if is_closed else "cyan"))
 
-    def _retrace_path(self, node):
-        if self.nodes[node]['parent'] is None:
-            return [node]
-        else:
-            return self._retrace_path(self.nodes[node]['parent']) + [node]
-
-    def retrace_path(self, node):
-        path = self._retrace_path(node)
+    def retrace_path(self, start, cells):
+        path = [start] + [self.grid.coordinates(cell) for cell in cells]
         if self.enable_path_visualization:
             for p in path:
                 self.draw_node(p, pygame.Color("red"))
         return path
 
-    def open_set_add(self, node):
-        heappush(self.open_heap, (self.nodes[node]['f'], self.nodes[node]['h'], node))
-        self.open_set.add(node)
-
-    def open_set_remove(self, node):
-        self.open_heap.remove((self.nodes[node]['f'], self.nodes[node]['h'], node))
-        self.open_set.remove(node)
-
-    def open_set_pop_lowest_f_score(self):
-        node = heappop(self.open_heap)[2]
-        self.open_set.remove(node)
-        return node
-
-    def clear_data(self):
-        self.open_set = set()
-        self.open_heap = []
-        self.closed_set = set()
-        self.nodes = {}
-
     def get_path(self, start, goal):
-        self.clear_data()
-
-        # Add start node to the open set
-        h = self.heuristic_estimate_cost(start, goal)
-        self.nodes[start] = {'g': 0, 'h': h, 'f': h, 'parent': None}
-        self.open_set_add(start)        
- 
-        while self.open_set:
-            # Choose lowest f-score in the open list. Use h-score as a tie-breaker
-            current = self.open_set_pop_lowest_f_score()
-            self.closed_set.add(current)
-            if current == goal:
-                return self.retrace_path(current)
-
-            # Draw the closed set
-            if self.enable_path_visualization:
-                self.draw_node(current, pygame.Color("green"))
-
-            # Get neighbors
-            neighbors = []
-            direction_offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)]  # Left, right, up, down
-            for ox, oy in direction_offsets:
-                neighbor = (current[0]+ox, current[1]+oy) 
-                if self.wrap_coordinates:
-                    neighbor = self.wrap_node(neighbor)
-                if self.is_neighbor(neighbor):
-                    neighbors.append(neighbor)
-
-            # Calculate path scores
-            for neighbor in neighbors:
-                g = self.nodes[current]['g'] + self.movement_cost(current, neighbor)
-                if neighbor in self.open_set and g < self.nodes[neighbor]['g']:
-                    self.open_set_remove(neighbor)
-                if neighbor in self.closed_set and g < self.nodes[neighbor]['g']:
-                    self.closed_set.remove(neighbor)
-                if neighbor not in self.open_set and neighbor not in self.closed_set:
-                    h = self.heuristic_estimate_cost(neighbor, goal)
-                    self.nodes[neighbor] = {'g': g, 'h': h, 'f': g+h, 'parent': current}
-                    self.open_set_add(neighbor)
-                    # Draw the open set
-                    if self.enable_path_visualization:
-                        self.draw_node(neighbor, pygame.Color("cyan"))
-                # If we find a different goal we like, return the path to it.
-                if self.retarget_alternate_goals and neighbor != goal and self.is_alternate_goal(neighbor):
-                    return self.retrace_path(neighbor)
-
-        # If no path was found
-        return False
+        """Returns the nodes from start to goal, both included, or False if
+        there is no path. If we find a different goal we like on the way, the
+        path to it is returned instead."""
+        grid = self.grid
+        goal_cell = grid.index(*goal)
+        h_scores = grid.distances(goal_cell).tolist()
+        self.path_finder.on_visit = self.visit_cell if self.enable_path_visualization else None
+        stop_at = None
+        if self.retarget_alternate_goals:
+            stop_at = self.alternate_goal_cells().__getitem__
+        cells = self.path_finder.find(grid.index(*start), goal_cell, self.blocked_cells(),
+                lambda cell, goal: h_scores[cell], stop_at=stop_at)
+        self.nodes_expanded = self.path_finder.nodes_expanded
+        if cells is None:
+            # If no path was found
+            return False
+        return self.retrace_path(start, cells)
 
 class JasonAI(AStar):
     MAX_SAFETY_SCORE = 100
+    ticks_per_execute = 3  # Players only move every third tick
 
     def __init__(self, player, *args, **kwargs):
         super(JasonAI, self).__init__()
         self.player = player
+        self.player_index = kwargs['player_index']
+        self.apple_distances = kwargs.get('apple_distances')  # An AppleDistances
         self.player.onkill = self.onkill
         # self.last_known_position = None
 
@@ -136,20 +79,19 @@ class JasonAI(AStar):
         self.check_for_closer_apples = True
         
         self.destination = None
+        self.known_apples = None
         self.path = None
 
         self.survival_cycles = 0
 
-    def is_neighbor(self, node):
+    def blocked_cells(self):
+        blocked = self.grid.blocked(game.board.codes)
         node_behind_player = self.node_at_direction(self.get_opposite_direction(self.player.direction))
-        return not self.is_out_of_bounds(node) and self.is_traversable(node) and node != node_behind_player
+        blocked[self.grid.index(*node_behind_player)] = True
+        return blocked
 
-    def is_alternate_goal(self, node):
-        if self.is_apple(node):
-            # print "Found a different apple!"
-            return True
-        else:
-            return False
+    def alternate_goal_cells(self):
+        return (game.board.codes.ravel() == game.APPLE).tolist()
 
     def wrap_node(self, node):
         x, y = node
@@ -166,9 +108,6 @@ class JasonAI(AStar):
     def draw_node(self, node, color):
         pygame.draw.rect(game.screen, color, pygame.Rect(node[0]*game.CELL_WIDTH, node[1]*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT))
 
-    def movement_cost(self, node1, node2):
-        return 1
-
     def heuristic_estimate_cost(self, start, goal):
         x_distance = abs(start[0]-goal[0])
         y_distance = abs(start[1]-goal[1])
@@ -177,9 +116,6 @@ class JasonAI(AStar):
             y_distance = min(y_distance, game.BOARD_HEIGHT - y_distance)
         return (x_distance + y_distance)
 
-    def is_out_of_bounds(self, node):
-        return not (0 <= node[0] < game.BOARD_WIDTH and 0 <= node[1] < game.BOARD_HEIGHT)
-
     def is_traversable(self, node):
         return self.get_board_object(node) is None or self.is_apple(node)
 
@@ -196,12 +132,33 @@ class JasonAI(AStar):
     def is_wall(self, node):
         return isinstance(self.get_board_object(node), game_objects.Wall)
 
+    def get_apple_descent(self):
+        """Returns the path from the player to its closest apple down the apple distance field, or None if there isn't one that doesn't turn back."""
+        if self.apple_distances is None:
+            return None
+        node_behind_player = self.node_at_direction(self.get_opposite_direction(self.player.direction))
+        cells = self.grid.descend(self.apple_distances.get(), self.grid.index(self.player.x, self.player.y), self.grid.index(*node_behind_player))
+        if cells is None:
+            return None
+        return [(self.player.x, self.player.y)] + [self.grid.coordinates(cell) for cell in cells]
+
     def get_closest_apple(self):
+        path = self.get_apple_descent()
+        if path:
+            return path[-1]
+        # No apple can be reached, so take the closest as the crow flies
         apple = min((self.heuristic_estimate_cost((self.player.x, self.player.y), (apple.x, apple.y)), apple) for apple in game.apples)[1]
         return (apple.x, apple.y)
 
+    def apples_changed(self):
+        """Tells whether apples have come or gone since we last looked, which is when a closer one can turn up."""
+        apples = [(apple.x, apple.y) for apple in game.apples]
+        changed = apples != self.known_apples
+        self.known_apples = apples
+        return changed
+
     def get_board_object(self, node):
-        return game.board[node[0]][node[1]]
+        return game.board[node]
 
     def translate_direction(self, facing_direction, going_direction):
         left = {game.LEFT: game.DOWN, game.RIGHT: game.UP, game.UP: game.LEFT, game.DOWN: game.RIGHT}
@@ -330,8 +287,13 @@ class JasonAI(AStar):
         return self.node_at_direction(safest_direction)
 
     def prepare_closest_apple_path(self):
-        self.destination = self.get_closest_apple()
-        path = self.get_path((self.player.x, self.player.y), self.destination)
+        # Follow the apple distance field if we can, otherwise search for a path
+        path = self.get_apple_descent()
+        if path:
+            self.destination = path[-1]
+        else:
+            self.destination = self.get_closest_apple()
+            path = tracing.traced_search(self, self.get_path, (self.player.x, self.player.y), self.destination)
         if path:
             self.path = deque(path)
             self.path.popleft()  # Discard current position
@@ -360,7 +322,7 @@ class JasonAI(AStar):
                 # print "Apple no longer available"
                 self.path = None
             # Check if a closer apple appeared
-            elif self.check_for_closer_apples and self.destination != self.get_closest_apple():
+            elif self.check_for_closer_apples and self.apples_changed() and self.destination != self.get_closest_apple():
                 # print "Found closer apple"
                 self.path = None
 
@@ -469,7 +431,7 @@ class JasonAI(AStar):
                 # pygame.time.wait(1000*10)
 
     def press_key(self, direction):
-        pygame.event.post(pygame.event.Event(KEYDOWN, {'key': game.player_controls[self.player.player_number][direction]}))
+        game.handle_input(self.player_index, direction)
 
     def execute(self):
         # # Skip if player has not yet moved
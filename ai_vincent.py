@@ -1,4 +1,3 @@
-import heapq
 import time
 from collections import deque, defaultdict
 
@@ -6,30 +5,24 @@ import pygame
 
 from process import AIProcess
 import game
+import pathfinding
+import tracing
 
 VISUALIZE = False
+VISIT_COLORS = (pygame.Color(100, 100, 100), pygame.Color(55, 55, 55))  # Open, closed
 OPPOSITE_DIRECTIONS = [game.RIGHT, game.LEFT, game.DOWN, game.UP,]
 _DIRECTIONS = ['left', 'right', 'up', 'down']
 
 HEURISTIC_SCALE = 10
+SOLID = frozenset((game.WALL, game.INDESTRUCTABLE_WALL, game.SNAKE))
 firing_range = 0
 
 class Node(object):
+    """ A cell of the board. """
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         self.x, self.y = x, y
-        self.f_score = 0
-        self.g_score = 0
-        self.h_score = 0
-
-        width = game.CELL_WIDTH
-        height = game.CELL_HEIGHT
-        self.rect = pygame.Rect(x*width, y*height, width, height)
-
-    def __lt__(self, other):
-        """ Used by heapq for maintaining the priority queue. """
-        if self.f_score == other.f_score:
-            return self.h_score < other.h_score
-        return self.f_score < other.f_score
 
     def __eq__(self, other):
         """ Used to compare nodes. Nodes are the same if their coordinates are
@@ -43,23 +36,23 @@ class Node(object):
 
     def __hash__(self):
         """ Used on members of hashed collections, i.e. sets and dictionaries.
-            Here we want nodes to be unique by their coodinates in the
-            closed_set. """
-        return int('1%d%d' % (self.x, self.y))
+            The cell's index on the board, which is unique to its
+            coordinates. """
+        return self.x*game.BOARD_HEIGHT + self.y
 
     def __repr__(self):
-        return '%d, %d, %d, %d' % (self.x, self.y, self.g_score, self.f_score)
+        return '%d, %d' % (self.x, self.y)
 
     def get_coordinates(self):
         return (self.x, self.y)
 
-    def draw(self, color):
-        if VISUALIZE:
-            pygame.draw.rect(game.screen, color, self.rect)
-
 class VincentAI(AIProcess):
     def __init__(self, player, *args, **kwargs):
         super(VincentAI, self).__init__(*args, **kwargs)
+        self.grid = pathfinding.get_grid(game.BOARD_WIDTH, game.BOARD_HEIGHT)
+        self.path_finder = pathfinding.PathFinder(self.grid)
+        if VISUALIZE:
+            self.path_finder.on_visit = self.draw_visit
         self.update_position()
         self.goal = None
         self.path = None
@@ -85,7 +78,7 @@ class VincentAI(AIProcess):
         if not self.path:
             apple = self.get_best_apples()[0][1]
             self.goal = Node(apple.x, apple.y)
-            self.path = self.a_star(self.goal)
+            self.path = tracing.traced_search(self, self.a_star, self.goal)
             if not self.path:
                 return
 
@@ -96,15 +89,18 @@ class VincentAI(AIProcess):
             next_move = self.get_node_in_direction(self.node, self.player.direction)
             self.path = None
 
-        if self.missile_positions[next_move.x][next_move.y] or self.board[next_move.x][next_move.y] in ('W', 'I', 'S', 'M',):
+        if (next_move.x, next_move.y) in self.missile_positions or self.board[next_move.x, next_move.y] in game.OBSTACLES:
             # Running into something. Take evasive action!
             possible_moves = []
             for n in self.get_walkable_neighbors(self.node):
-                if self.missile_positions[n.x][n.y] or self.board[n.x][n.y] in ('W', 'I', 'S', 'M',):
+                if (n.x, n.y) in self.missile_positions or self.board[n.x, n.y] in game.OBSTACLES:
                     continue
                 possible_moves.append(n)
             if possible_moves:
-                next_move = min([(self.board_modifiers[m.x][m.y], m) for m in possible_moves])[1]
+                # Keep out of pockets too small to hold us
+                length = self.player.length
+                next_move = min(possible_moves, key=lambda m: (self.reachable_area(m.x, m.y, length) < length,
+                        self.board_modifiers[m.x, m.y]))
 
         moved = False
         for direction in [game.LEFT, game.RIGHT, game.UP, game.DOWN,]:
@@ -120,41 +116,27 @@ class VincentAI(AIProcess):
             self.update_board_modifiers()
 
     def reconsider_path(self):
-        if not self.path or self.board[self.goal.x][self.goal.y] != 'A':
+        if not self.path or self.board[self.goal.x, self.goal.y] != game.APPLE:
             return True
         for i in range(-1, -6, -1):
             if i < -len(self.path):
                 break
             step = self.path[i]
             x, y = step
-            if self.board[x][y] in ('W', 'I', 'S', 'M',):
+            if self.board[x, y] in game.OBSTACLES:
                 return True
         return False
 
     def update_board_modifiers(self):
-        """ Update modifiers that are used in A* heuristic estimates. """
-        self.board_modifiers = [[0,] * game.BOARD_HEIGHT for i in range(game.BOARD_WIDTH)]
-        for x, row in enumerate(self.board):
-            for y, obj in enumerate(row):
-                if obj in ('W', 'I', 'S', 'M',):
-                    for i in (-1, 0, 1,):
-                        for j in (-1, 0, 1):
-                            _x, _y = x + i, y + j
-                            # Account for board wrapping
-                            if _x < 0:
-                                _x = game.BOARD_WIDTH-1
-                            if _x >= game.BOARD_WIDTH:
-                                _x = 0
-                            if _y < 0:
-                                _y = game.BOARD_HEIGHT-1
-                            if _y >= game.BOARD_HEIGHT:
-                                _y = 0
-                            self.board_modifiers[_x][_y] += 1
+        """ Update modifiers that are used in A* heuristic estimates: the
+            number of obstacles around each cell. """
+        self.flat_board_modifiers = self.grid.obstacles_nearby(self.board)
+        self.board_modifiers = self.flat_board_modifiers.reshape(self.board.shape)
 
     def update_enemy_positions(self):
         """ Update possible positions enemies up to _firing_range_ turns later. """
         self.player_positions = defaultdict(set)
-        self.missile_positions = [[0,] * game.BOARD_HEIGHT for i in range(game.BOARD_WIDTH)]
+        self.missile_positions = set()  # Cells a missile may reach soon
         for i in range(1, firing_range + 1):
             if i == 1:
                 nodes = [Node(player.x, player.y) for player in self._players if Node(player.x, player.y) != self.node]
@@ -163,14 +145,14 @@ class VincentAI(AIProcess):
             for node in nodes:
                 for direction in [game.LEFT, game.RIGHT, game.UP, game.DOWN,]:
                     next_move = self.get_node_in_direction(node, direction)
-                    if self.board[next_move.x][next_move.y] not in ('W', 'I', 'S', 'M',):
+                    if self.board[next_move.x, next_move.y] not in game.OBSTACLES:
                         self.player_positions[i].add(next_move)
 
         for m in game.missiles:
             node = Node(m.x, m.y)
             for i in range(6):
                 node = self.get_node_in_direction(node, m.direction)
-                self.missile_positions[node.x][node.y] = 1
+                self.missile_positions.add((node.x, node.y))
 
         for player in self._players:
             node = Node(player.x, player.y)
@@ -178,7 +160,7 @@ class VincentAI(AIProcess):
                 continue
             for i in range(6):
                 node = self.get_node_in_direction(node, player.direction)
-                self.missile_positions[node.x][node.y] = 1
+                self.missile_positions.add((node.x, node.y))
 
     def consider_fire(self):
         """ Determine whether the player is in range of hitting an enemy up to
@@ -186,7 +168,7 @@ class VincentAI(AIProcess):
         node = self.node
         for i in range(firing_range * 3):
             node = self.get_node_in_direction(node, self.player.direction)
-            if self.board[node.x][node.y] in ('W', 'I', 'S',):
+            if self.board[node.x, node.y] in SOLID:
                 return False
             if node in self.player_positions[i//3 + 1]:
                 return True
@@ -226,64 +208,38 @@ class VincentAI(AIProcess):
             min(distance_y, game.BOARD_HEIGHT - distance_y)
 
     def a_star(self, goal):
-        start = Node(self.player.x, self.player.y)
-        behind_node = self.get_node_in_direction(start, OPPOSITE_DIRECTIONS[self.player.direction])
-        closed_set = set([behind_node,]) # The set of nodes already evaluated
-        open_heap = [start] # The set of tentative nodes to be evaluated
-        came_from = {} # The map of navigated nodes
-
-        start.g_score = 0 # Cost from start along best known path
-        start.h_score = self.heuristic_cost_estimate(start, goal)
-        # Estimated total cost from start to goal through y
-        start.f_score = start.g_score + start.h_score
-
-        while open_heap:
-            current = heapq.heappop(open_heap)
-            if current == goal:
-                if VISUALIZE:
-                    pygame.display.flip()
-                return self.reconstruct_path(came_from, goal.get_coordinates())
-            closed_set.add(current)
-            current.draw(pygame.Color(55, 55, 55))
-
-            for neighbor in self.get_walkable_neighbors(current):
-                tentative_g_score = current.g_score + self.dist_between(current, neighbor)
-                tentative_h_score = self.heuristic_cost_estimate(neighbor, goal)
-                tentative_f_score = tentative_g_score + tentative_h_score
-                if neighbor in closed_set and tentative_f_score >= neighbor.f_score:
-                    continue
+        """ Returns a deque of the steps to _goal_, the next step last, or
+            None if there is no path. A cell is kept by the first path that
+            reaches it. """
+        grid = self.grid
+        start = grid.index(self.player.x, self.player.y)
+        blocked = grid.blocked(self.board)
+        blocked[grid.neighbor(start, OPPOSITE_DIRECTIONS[self.player.direction])] = True
+        goal = grid.index(goal.x, goal.y)
+        # The distance to the goal, plus the number of obstacles nearby
+        h_scores = ((grid.distances(goal) + self.flat_board_modifiers) * HEURISTIC_SCALE).tolist()
+
+        path = self.path_finder.find(start, goal, blocked, lambda cell, goal: h_scores[cell])
+        self.nodes_expanded = self.path_finder.nodes_expanded
+        if VISUALIZE:
+            pygame.display.flip()
+        if path is None:
+            self.path = None
+            return None
+        return deque(grid.coordinates(cell) for cell in reversed(path))
 
-                if neighbor not in open_heap or tentative_f_score < neighbor.f_score:
-                    came_from[neighbor.get_coordinates()] = current.get_coordinates()
-                    neighbor.g_score = tentative_g_score
-                    neighbor.h_score = tentative_h_score
-                    neighbor.f_score = tentative_f_score
-                    if neighbor not in open_heap:
-                        heapq.heappush(open_heap, neighbor)
-                        neighbor.draw(pygame.Color(100, 100, 100))
-        # No path found
-        self.path = None
+    def draw_visit(self, cell, is_closed):
+        """ Shows the search, when VISUALIZE is on. """
+        pygame.draw.rect(game.screen, VISIT_COLORS[is_closed], self.grid.rect(cell))
 
     def get_walkable_neighbors(self, node):
         """ Evaluate the node's 4 neighbors and return the walkable ones. """
         for direction in [game.LEFT, game.RIGHT, game.UP, game.DOWN,]:
             neighbor = self.get_node_in_direction(node, direction)
             x, y = neighbor.x, neighbor.y
-            if self.board[x][y] not in ('W', 'I', 'S', 'M'):
+            if self.board[x, y] not in game.OBSTACLES:
                 yield neighbor
 
-    def heuristic_cost_estimate(self, start, goal):
-        estimate = self.dist_between(start, goal) * HEURISTIC_SCALE
-        estimate += self.board_modifiers[start.x][start.y] * HEURISTIC_SCALE
-        return estimate
-
-    def reconstruct_path(self, came_from, current_node):
-        path = deque()
-        while current_node in came_from:
-            path.append(current_node)
-            current_node = came_from[current_node]
-        return path
-
     def get_node_in_direction(self, node, direction):
         x, y = node.x, node.y
         if direction == game.LEFT:
@@ -0,0 +1,459 @@
+""" Batched simulator that steps many independent games in lockstep.
+
+    The boards, snakes, missiles and apples of all games are stored as stacked
+    numpy arrays. The common case of every phase, a snake or missile moving
+    into an empty cell, is advanced for all games at once; the rarer
+    collisions are resolved game by game following the same rules as
+    Player.update_position, Missile.update and game.add_apple.
+
+    Every game keeps a free-cell index like game.Board's, updated through
+    _set_cells and _clear_cells in the same order as the engine, so apples
+    are drawn from identical lists. """
+import argparse
+import random
+import time
+
+import numpy
+
+import game
+import level
+
+DX = numpy.array([-1, 1, 0, 0])
+DY = numpy.array([0, 0, -1, 1])
+OPPOSITE = numpy.array([game.RIGHT, game.LEFT, game.DOWN, game.UP])
+NO_INPUT = -1
+
+class BatchSimulator(object):
+    """ N games on the same level. Inputs for a tick are given to step() as an
+        (N, players) array of directions, with NO_INPUT for no key press. """
+    def __init__(self, level, num_games, num_players=4, seeds=None, missile_capacity=16):
+        if seeds is None:
+            seeds = range(num_games)
+        self.num_games = n = num_games
+        self.width = w = level.width
+        self.height = h = level.height
+        self.rngs = [random.Random(seed) for seed in seeds]
+        self.tick_count = 1
+        self.ticks_until_update_position = 3
+
+        # Board cell codes, and the player index or missile id owning each cell
+        self.codes = numpy.zeros((n, w, h), numpy.uint8)
+        self.owner = numpy.zeros((n, w, h), numpy.int32)
+
+        # Empty cells by flat index x*h + y, and each cell's place in the list
+        self.free = numpy.tile(numpy.arange(w * h, dtype=numpy.int32), (n, 1))
+        self.free_position = self.free.copy()
+        self.free_count = numpy.repeat(w * h, n)
+
+        spawns = []
+        games = numpy.arange(n)
+        for x, y, code, number in level.placements:
+            if code == game.SNAKE:
+                if number > num_players:
+                    continue
+                self.owner[:, x, y] = len(spawns)
+                spawns.append((x, y, level.player_directions[str(number)]))
+            self._set_cells(games, numpy.repeat(x, n), numpy.repeat(y, n), code)
+        self.num_players = p = len(spawns)
+        self.spawn_x = numpy.array([s[0] for s in spawns])
+        self.spawn_y = numpy.array([s[1] for s in spawns])
+        self.spawn_direction = numpy.array([s[2] for s in spawns])
+
+        # Snake bodies are ring buffers of coordinates, from tail to head,
+        # grown when a snake outgrows them
+        self.capacity = c = min(64, w * h + 1)
+        self.body_x = numpy.zeros((n, p, c), numpy.int16)
+        self.body_y = numpy.zeros((n, p, c), numpy.int16)
+        self.tail = numpy.zeros((n, p), numpy.intp)
+        self.length = numpy.ones((n, p), numpy.intp)
+        self.x = numpy.tile(self.spawn_x, (n, 1))
+        self.y = numpy.tile(self.spawn_y, (n, 1))
+        self.direction = numpy.tile(self.spawn_direction, (n, 1))
+        self.body_x[:, :, 0] = self.x
+        self.body_y[:, :, 0] = self.y
+        self.lock = numpy.zeros((n, p), bool)
+        self.invincible = numpy.zeros((n, p), bool)
+        self.kills = numpy.zeros((n, p), numpy.intp)
+        self.deaths = numpy.zeros((n, p), numpy.intp)
+
+        # Missiles are kept in firing order, like game.missiles
+        self.missile_x = numpy.zeros((n, missile_capacity), numpy.intp)
+        self.missile_y = numpy.zeros((n, missile_capacity), numpy.intp)
+        self.missile_direction = numpy.zeros((n, missile_capacity), numpy.intp)
+        self.missile_player = numpy.zeros((n, missile_capacity), numpy.intp)
+        self.missile_id = numpy.zeros((n, missile_capacity), numpy.int32)
+        self.missile_active = numpy.zeros((n, missile_capacity), bool)
+        self.missile_count = numpy.zeros(n, numpy.intp)
+        self.next_missile_id = 1
+
+        self.apple_x = numpy.zeros((n, level.num_apples), numpy.intp)
+        self.apple_y = numpy.zeros((n, level.num_apples), numpy.intp)
+        for g in range(n):
+            for i in range(level.num_apples):
+                self._place_apple(g, i)
+
+    def step(self, directions=None):
+        """ Advances every game by one tick. """
+        if directions is not None:
+            self._apply_inputs(numpy.asarray(directions))
+        self._update_missiles()
+        if self.tick_count < self.ticks_until_update_position:
+            self.tick_count += 1
+        else:
+            for p in range(self.num_players):
+                self._update_player_positions(p)
+            self.tick_count = 1
+
+        # Drop destroyed missiles, keeping the others in firing order
+        if (self.missile_active.sum(axis=1) != self.missile_count).any():
+            self._compact_missiles()
+
+    def _set_cells(self, games, x, y, code):
+        """ Fills one empty cell in each of _games_. """
+        self.codes[games, x, y] = code
+        i = x * self.height + y
+        position = self.free_position[games, i]
+        self.free_count[games] -= 1
+        last = self.free[games, self.free_count[games]]
+        self.free[games, position] = last
+        self.free_position[games, last] = position
+        self.free_position[games, i] = -1
+
+    def _clear_cells(self, games, x, y):
+        """ Empties one cell in each of _games_. """
+        self.codes[games, x, y] = game.EMPTY
+        i = x * self.height + y
+        filled = self.free_position[games, i] < 0
+        games, i = games[filled], i[filled]
+        self.free[games, self.free_count[games]] = i
+        self.free_position[games, i] = self.free_count[games]
+        self.free_count[games] += 1
+
+    def _apply_inputs(self, directions):
+        for p in range(self.num_players):
+            d = directions[:, p]
+            current = self.direction[:, p]
+            allowed = (d != NO_INPUT) & ~self.lock[:, p]
+            fire = allowed & (d == current)
+            turn = allowed & (d != current) & (d != OPPOSITE[current])
+            self.direction[turn, p] = d[turn]
+            self.lock[turn, p] = True
+            self._fire(numpy.nonzero(fire & (self.length[:, p] > 1))[0], p)
+
+    def _fire(self, games, p):
+        if not len(games):
+            return
+        # Remove the tail
+        tail = self.tail[games, p]
+        self._clear_cells(games, self.body_x[games, p, tail], self.body_y[games, p, tail])
+        self.tail[games, p] = (tail + 1) % self.capacity
+        self.length[games, p] -= 1
+
+        # Launch it from the cell ahead of the head
+        d = self.direction[games, p]
+        x = (self.x[games, p] + DX[d]) % self.width
+        y = (self.y[games, p] + DY[d]) % self.height
+        occupant = self.codes[games, x, y]
+
+        # A missile already there blocks the launch and the part is reattached
+        blocked = occupant == game.MISSILE
+        self.tail[games[blocked], p] = tail[blocked]
+        self.length[games[blocked], p] += 1
+
+        free = occupant == game.EMPTY
+        games, x, y, d = games[free], x[free], y[free], d[free]
+        if not len(games):
+            return
+        if self.missile_count[games].max() >= self.missile_x.shape[1]:
+            self._grow_missiles()
+        slot = self.missile_count[games]
+        ids = numpy.arange(self.next_missile_id, self.next_missile_id + len(games))
+        self.next_missile_id += len(games)
+        self.missile_x[games, slot] = x
+        self.missile_y[games, slot] = y
+        self.missile_direction[games, slot] = d
+        self.missile_player[games, slot] = p
+        self.missile_id[games, slot] = ids
+        self.missile_active[games, slot] = True
+        self.missile_count[games] += 1
+        self._set_cells(games, x, y, game.MISSILE)
+        self.owner[games, x, y] = ids
+
+    def _grow_missiles(self):
+        for name in ('missile_x', 'missile_y', 'missile_direction',
+                'missile_player', 'missile_id', 'missile_active'):
+            old = getattr(self, name)
+            new = numpy.zeros((old.shape[0], old.shape[1] * 2), old.dtype)
+            new[:, :old.shape[1]] = old
+            setattr(self, name, new)
+
+    def _update_missiles(self):
+        if not self.missile_count.any():
+            return
+        for m in range(self.missile_count.max()):
+            games = numpy.nonzero(self.missile_active[:, m])[0]
+            if not len(games):
+                continue
+            ids = self.missile_id[games, m]
+            old_x, old_y = self.missile_x[games, m], self.missile_y[games, m]
+            d = self.missile_direction[games, m]
+            x = (old_x + DX[d]) % self.width
+            y = (old_y + DY[d]) % self.height
+            self.missile_x[games, m] = x
+            self.missile_y[games, m] = y
+
+            # Leave the old cell if the missile is still on it
+            on_board = (self.codes[games, old_x, old_y] == game.MISSILE) & \
+                (self.owner[games, old_x, old_y] == ids)
+            self._clear_cells(games[on_board], old_x[on_board], old_y[on_board])
+
+            occupant = self.codes[games, x, y]
+            free = occupant == game.EMPTY
+            self._set_cells(games[free], x[free], y[free], game.MISSILE)
+            self.owner[games[free], x[free], y[free]] = ids[free]
+
+            # Missiles fly over apples without being drawn on the board
+            hit = ~free & (occupant != game.APPLE)
+            for g, _x, _y in zip(games[hit], x[hit], y[hit]):
+                self._missile_collision(g, m, _x, _y)
+
+    def _missile_collision(self, g, m, x, y):
+        occupant = self.codes[g, x, y]
+        if occupant == game.MISSILE:
+            other = numpy.nonzero(self.missile_id[g] == self.owner[g, x, y])[0][0]
+            self.missile_active[g, other] = False
+            self._clear_cell(g, x, y)
+        elif occupant == game.WALL:
+            self._clear_cell(g, x, y)
+        elif occupant == game.SNAKE:
+            q = self.owner[g, x, y]
+            if (self.x[g, q], self.y[g, q]) == (x, y):
+                self._kill(g, q, ('missile', self.missile_player[g, m]))
+        self.missile_active[g, m] = False
+
+    def _compact_missiles(self):
+        order = numpy.argsort(~self.missile_active, axis=1, kind='mergesort')
+        rows = numpy.arange(self.num_games)[:, None]
+        for name in ('missile_x', 'missile_y', 'missile_direction',
+                'missile_player', 'missile_id', 'missile_active'):
+            setattr(self, name, getattr(self, name)[rows, order])
+        self.missile_count = self.missile_active.sum(axis=1)
+
+    def _update_player_positions(self, p):
+        n = numpy.arange(self.num_games)
+        d = self.direction[:, p]
+        x = (self.x[:, p] + DX[d]) % self.width
+        y = (self.y[:, p] + DY[d]) % self.height
+        self.x[:, p] = x
+        self.y[:, p] = y
+        occupant = self.codes[n, x, y]
+
+        # Invincible snakes pass through everything until they reach an apple
+        invincible = self.invincible[:, p]
+        self.invincible[invincible & (occupant == game.APPLE), p] = False
+        ghosts = invincible & (occupant != game.APPLE)
+        tail = self.tail[ghosts, p]
+        self.body_x[ghosts, p, tail] = x[ghosts]
+        self.body_y[ghosts, p, tail] = y[ghosts]
+        self.lock[ghosts, p] = False
+
+        moving = ~ghosts & (occupant == game.EMPTY)
+        games = n[moving]
+        self._push_head(games, p, x[moving], y[moving])
+        self._pop_tail(games, p)
+        self.lock[games, p] = False
+
+        collided = ~ghosts & (occupant != game.EMPTY)
+        for g, _x, _y in zip(n[collided], x[collided], y[collided]):
+            self._player_collision(g, p, _x, _y)
+
+    def _push_head(self, games, p, x, y):
+        if len(games) and self.length[games, p].max() >= self.capacity:
+            self._grow_bodies()
+        head = (self.tail[games, p] + self.length[games, p]) % self.capacity
+        self.body_x[games, p, head] = x
+        self.body_y[games, p, head] = y
+        self.length[games, p] += 1
+        self._set_cells(games, x, y, game.SNAKE)
+        self.owner[games, x, y] = p
+
+    def _grow_bodies(self):
+        """ Doubles the capacity of the body ring buffers, unrolling them so
+            every tail is at index 0. """
+        c = self.capacity
+        j = (self.tail[..., None] + numpy.arange(c)) % c
+        for name in ('body_x', 'body_y'):
+            old = getattr(self, name)
+            new = numpy.zeros(old.shape[:2] + (c * 2,), old.dtype)
+            new[..., :c] = numpy.take_along_axis(old, j, axis=2)
+            setattr(self, name, new)
+        self.tail[:] = 0
+        self.capacity = c * 2
+
+    def _pop_tail(self, games, p):
+        tail = self.tail[games, p]
+        self._clear_cells(games, self.body_x[games, p, tail], self.body_y[games, p, tail])
+        self.tail[games, p] = (tail + 1) % self.capacity
+        self.length[games, p] -= 1
+
+    def _player_collision(self, g, p, x, y):
+        occupant = self.codes[g, x, y]
+        games = numpy.array([g])
+        if occupant == game.APPLE:
+            i = numpy.nonzero((self.apple_x[g] == x) & (self.apple_y[g] == y))[0][0]
+            self._clear_cell(g, x, y)
+            self._push_head(games, p, numpy.array([x]), numpy.array([y]))
+            self._place_apple(g, i)
+            self.lock[g, p] = False
+            return
+
+        if occupant == game.MISSILE:
+            missile = numpy.nonzero(self.missile_id[g] == self.owner[g, x, y])[0][0]
+            self._kill(g, p, ('missile', self.missile_player[g, missile]))
+            self.missile_active[g, missile] = False
+            self._clear_cell(g, x, y)
+        elif occupant == game.SNAKE:
+            q = self.owner[g, x, y]
+            self._kill(g, p, ('snake', q, x, y))
+            if (self.x[g, q], self.y[g, q]) == (x, y):
+                self._kill(g, q, ('snake', p, self.x[g, p], self.y[g, p]))
+        else:
+            self._kill(g, p, ('wall',))
+
+    def _kill(self, g, p, collidee):
+        self.deaths[g, p] += 1
+        if collidee[0] == 'missile':
+            if collidee[1] != p:
+                self.kills[g, collidee[1]] += 1
+        elif collidee[0] == 'snake':
+            q, x, y = collidee[1:]
+            if q != p and (self.x[g, q], self.y[g, q]) != (x, y):
+                self.kills[g, q] += 1
+
+        # Clear the body and respawn
+        for i in range(self.length[g, p]):
+            j = (self.tail[g, p] + i) % self.capacity
+            self._clear_cell(g, self.body_x[g, p, j], self.body_y[g, p, j])
+        self.x[g, p] = self.spawn_x[p]
+        self.y[g, p] = self.spawn_y[p]
+        self.direction[g, p] = self.spawn_direction[p]
+        self.tail[g, p] = 0
+        self.length[g, p] = 1
+        self.body_x[g, p, 0] = self.spawn_x[p]
+        self.body_y[g, p, 0] = self.spawn_y[p]
+        self.invincible[g, p] = True
+        self.lock[g, p] = False
+
+    def _clear_cell(self, g, x, y):
+        self._clear_cells(numpy.array([g]), numpy.array([x]), numpy.array([y]))
+
+    def _place_apple(self, g, i):
+        """ Moves apple _i_ to a random empty cell, like game.add_apple. On a
+            full board the apple is taken off the board. """
+        if not self.free_count[g]:
+            self.apple_x[g, i] = self.apple_y[g, i] = -1
+            return
+        x, y = divmod(self.free[g, self.rngs[g].randrange(self.free_count[g])], self.height)
+        self.apple_x[g, i] = x
+        self.apple_y[g, i] = y
+        self._set_cells(numpy.array([g]), numpy.array([x]), numpy.array([y]), game.APPLE)
+
+    def get_body(self, g, p):
+        """ Returns the coordinates of a snake from tail to head. """
+        j = (self.tail[g, p] + numpy.arange(self.length[g, p])) % self.capacity
+        return zip(self.body_x[g, p, j], self.body_y[g, p, j])
+
+def random_inputs(rng, num_players, rate):
+    return [rng.randrange(4) if rng.random() < rate else NO_INPUT
+            for i in range(num_players)]
+
+def check_parity(level_file, seeds, ticks, num_players=4, input_rate=0.08):
+    """ Plays the same seeded games with the same random inputs on the object
+        based engine and on a BatchSimulator. Returns None if every tick
+        matches, otherwise the seed, tick and part of the state of the first
+        difference. """
+    lvl = level.Level(level_file)
+    sim = BatchSimulator(lvl, len(seeds), num_players, seeds)
+    input_rngs = [random.Random(seed) for seed in seeds]
+    inputs = []
+    states = []
+    for tick in range(ticks):
+        inputs.append([random_inputs(rng, sim.num_players, input_rate) for rng in input_rngs])
+        sim.step(inputs[-1])
+        states.append([_batch_state(sim, g) for g in range(len(seeds))])
+
+    game.headless = True
+    game.level = lvl
+    game.num_players = num_players
+    for g, seed in enumerate(seeds):
+        game.init_level(seed)
+        for tick in range(ticks):
+            for player, direction in zip(game.players, inputs[tick][g]):
+                if direction != NO_INPUT:
+                    player.set_direction(direction)
+            game.update()
+            for key, value in _game_state().items():
+                if value != states[tick][g][key]:
+                    return seed, tick, key
+    return None
+
+def _game_state():
+    return _digest({
+        'board': game.board.codes.tostring(),
+        'players': [(p.x, p.y, p.direction, p.get_length(), len(p.kills),
+            len(p.deaths)) for p in game.players],
+        'apples': sorted((a.x, a.y) for a in game.apples),
+        'missiles': [(m.x, m.y, m.direction) for m in game.missiles],
+    })
+
+def _batch_state(sim, g):
+    count = sim.missile_count[g]
+    return _digest({
+        'board': sim.codes[g].tostring(),
+        'players': [(sim.x[g, p], sim.y[g, p], sim.direction[g, p],
+            sim.length[g, p], sim.kills[g, p], sim.deaths[g, p])
+            for p in range(sim.num_players)],
+        'apples': sorted((x, y) for x, y in zip(sim.apple_x[g], sim.apple_y[g]) if x >= 0),
+        'missiles': zip(sim.missile_x[g, :count], sim.missile_y[g, :count],
+            sim.missile_direction[g, :count]),
+    })
+
+def _digest(state):
+    """ Hashes each part of a state, so long runs can be compared cheaply. """
+    digest = {}
+    for key, value in state.items():
+        if not isinstance(value, str):
+            value = repr([tuple(int(v) for v in item) for item in value])
+        digest[key] = hash(value)
+    return digest
+
+def main():
+    parser = argparse.ArgumentParser(description='Step many games in lockstep.')
+    parser.add_argument('--level', default='levels/level1.ini')
+    parser.add_argument('--games', type=int, default=256)
+    parser.add_argument('--ticks', type=int, default=3000)
+    parser.add_argument('--parity', type=int, metavar='N',
+            help='check N seeded games against the object-based engine instead')
+    args = parser.parse_args()
+
+    if args.parity:
+        mismatch = check_parity(args.level, range(args.parity), args.ticks)
+        if mismatch:
+            print 'Seed %d differs at tick %d (%s)' % mismatch
+        else:
+            print '%d games matched for %d ticks' % (args.parity, args.ticks)
+        return
+
+    sim = BatchSimulator(level.Level(args.level), args.games)
+    rng = numpy.random.RandomState(0)
+    start_time = time.time()
+    for tick in range(args.ticks):
+        directions = rng.randint(0, 4, (args.games, sim.num_players))
+        directions[rng.random_sample(directions.shape) > 0.08] = NO_INPUT
+        sim.step(directions)
+    elapsed = time.time() - start_time
+    print '%d games x %d ticks in %.2fs: %d game ticks/s' % (args.games,
+            args.ticks, elapsed, args.games * args.ticks / elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+""" Measures the time the engine takes per tick on each level. The games are
+    seeded and driven by seeded random key presses, so every run plays the
+    same games and timings can be compared between versions of the code.
+
+    With --scaling, empty boards of growing size and player count are played
+    instead, to show the cost of a tick follows the number of snakes and not
+    the area of the board.
+
+    With --collisions, the engine resolves many collisions of each kind set
+    up side by side on an empty board, and the time each takes is reported. Few
+    ticks have a collision, so their cost hardly shows in whole ticks. """
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import game
+import game_objects
+import level
+from batch import random_inputs, NO_INPUT
+
+def play(level_file, seed, ticks, num_players=4, input_rate=0.08):
+    """ Plays one game and returns the seconds spent in the engine. """
+    input_rng = random.Random(seed)
+    inputs = [random_inputs(input_rng, num_players, input_rate) for i in range(ticks)]
+
+    game.headless = True
+    game.level = level.Level(level_file)
+    game.num_players = num_players
+    game.init_level(seed)
+
+    # Processor time is less disturbed by other programs than wall time
+    start_time = time.clock()
+    for tick_inputs in inputs:
+        for player, direction in zip(game.players, tick_inputs):
+            if direction != NO_INPUT:
+                player.set_direction(direction)
+        game.update()
+    return time.clock() - start_time
+
+SCALING_BOARDS = [(80, 45), (250, 250), (1000, 1000)]
+SCALING_PLAYERS = [4, 16, 64]
+
+def write_open_level(path, width, height, num_players, num_apples=None):
+    """ Writes a level without walls, with the players spread over a grid
+        and heading right. """
+    if num_apples is None:
+        num_apples = 2 * num_players
+    columns = 1
+    while columns * columns < num_players:
+        columns += 1
+    rows = (num_players + columns - 1) / columns
+    with open(path, 'w') as f:
+        f.write('[snake]\nname = Open %dx%d\nnum_apples = %d\nkills_to_win = 1000000\n'
+                'width = %d\nheight = %d\n\n[spawns]\n' % (width, height, num_apples, width, height))
+        for i in range(num_players):
+            row, column = divmod(i, columns)
+            f.write('%d = %d, %d, right\n' % (i + 1, (2*column + 1) * width / (2*columns),
+                    (2*row + 1) * height / (2*rows)))
+
+def scaling(ticks, seed, repeat, input_rate):
+    directory = tempfile.mkdtemp()
+    try:
+        for num_players in SCALING_PLAYERS:
+            for width, height in SCALING_BOARDS:
+                path = os.path.join(directory, 'open-%dx%d-%d.ini' % (width, height, num_players))
+                write_open_level(path, width, height, num_players)
+                elapsed = min(play(path, seed, ticks, num_players, input_rate)
+                        for i in range(repeat))
+                print '%4dx%-4d %3d players  %8.2f us/tick  %6.2f us/tick/player' % (
+                        width, height, num_players, elapsed / ticks * 1e6,
+                        elapsed / ticks / num_players * 1e6)
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+COLLISION_CASES = ['missile into wall', 'missile into snake', 'missile into missile',
+        'fire into wall', 'snake into wall', 'snake into snake', 'snake eats apple']
+COLLISION_LANE = 8  # Cells of a row each collision is set up in
+
+def write_empty_level(path, width, height):
+    """ Writes a level of _width_ by _height_ empty cells, without players or
+        apples. """
+    with open(path, 'w') as f:
+        f.write('[snake]\nname = Empty %dx%d\nnum_apples = 0\nkills_to_win = 1000000\n\n'
+                '[player_directions]\n\n[level]\nlayout =\n' % (width, height))
+        for y in range(height):
+            f.write('    %s\n' % ('.' * width))
+
+def add_tail(player):
+    """ Gives a player a second cell, behind its head. """
+    tail = (player.x - 1, player.y)
+    player.body.appendleft(tail)
+    game.board[tail] = player
+
+def collide(level_file, case):
+    """ Sets up one collision of _case_ in each lane of the level, and
+        returns the seconds taken to resolve them all and their number. In a
+        lane starting at x, a player heads right from x + 3, and a missile
+        from x + 1. """
+    game.headless = True
+    game.level = level.Level(level_file)
+    game.num_players = 0
+    game.init_level(1)
+
+    color = level.player_colors['1']
+    missiles = []
+    for y in range(game.board.height):
+        for x in range(0, game.board.width - COLLISION_LANE + 1, COLLISION_LANE):
+            player = game_objects.Player('Player %d' % (len(game.players) + 1),
+                    len(game.players), x + 3, y, game.RIGHT, color)
+            game.players.append(player)
+            if case == 'missile into wall':
+                game.walls.append(game_objects.Wall(x + 2, y))
+            elif case == 'missile into snake':
+                add_tail(player)
+            elif case == 'missile into missile':
+                game.missiles.append(game_objects.Missile(player, x + 2, y, game.LEFT, color))
+            elif case in ('fire into wall', 'snake into wall'):
+                add_tail(player)
+                game.walls.append(game_objects.Wall(x + 4, y))
+            elif case == 'snake into snake':
+                # Another snake's tail, so that only the mover dies
+                add_tail(player)
+                game.board[x + 4, y] = game.players[0]
+            elif case == 'snake eats apple':
+                game.apples.append(game_objects.Apple(x + 4, y))
+            if case.startswith('missile'):
+                missiles.append(game_objects.Missile(player, x + 1, y, game.RIGHT, color))
+                game.missiles.append(missiles[-1])
+
+    start_time = time.clock()
+    if missiles:
+        for missile in missiles:
+            missile.update()
+    elif case == 'fire into wall':
+        for player in game.players:
+            player.fire()
+    else:
+        for player in game.players:
+            player.update_position()
+    return time.clock() - start_time, len(game.players)
+
+def collisions(repeat, width=80, height=45):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'empty-%dx%d.ini' % (width, height))
+    try:
+        write_empty_level(path, width, height)
+        for case in COLLISION_CASES:
+            elapsed, count = min(collide(path, case) for i in range(repeat))
+            print '%-20s %6.2f us/collision' % (case, elapsed / count * 1e6)
+    finally:
+        os.remove(path)
+        os.rmdir(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the game engine on each level.')
+    parser.add_argument('--levels', nargs='+',
+            default=[lvl.config_file for lvl in level.get_levels()],
+            help='level files to play')
+    parser.add_argument('--ticks', type=int, default=6000,
+            help='ticks per game')
+    parser.add_argument('--seed', type=int, default=1,
+            help='random seed of the games')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='times each game is played; the fastest run is reported')
+    parser.add_argument('--input-rate', type=float, default=0.08,
+            help='chance of each player pressing a key on a tick')
+    parser.add_argument('--scaling', action='store_true',
+            help='play open boards of growing size and player count instead')
+    parser.add_argument('--collisions', action='store_true',
+            help='time each kind of collision instead')
+    args = parser.parse_args()
+
+    if args.collisions:
+        collisions(args.repeat)
+        return
+    if args.scaling:
+        scaling(args.ticks, args.seed, args.repeat, args.input_rate)
+        return
+
+    total = 0
+    for level_file in args.levels:
+        elapsed = min(play(level_file, args.seed, args.ticks, input_rate=args.input_rate)
+                for i in range(args.repeat))
+        total += elapsed
+        kills = sum(len(player.kills) for player in game.players)
+        deaths = sum(len(player.deaths) for player in game.players)
+        print '%-28s %6.2f us/tick  %7d ticks/s  (%d kills, %d deaths)' % (
+                level_file, elapsed / args.ticks * 1e6, args.ticks / elapsed,
+                kills, deaths)
+    print '%-28s %6.2f us/tick' % ('all levels', total / (args.ticks * len(args.levels)) * 1e6)
+
+if __name__ == '__main__':
+    main()
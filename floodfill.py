@@ -0,0 +1,104 @@
+""" Flood fills over the board, for telling how much room a snake has.
+
+    Fills spread a whole frontier of cells at a time: the cells next to a
+    set of cells are found by shifting a board-sized array one cell in each
+    direction, wrapping round the edges, so each step is a handful of numpy
+    operations however many cells the frontier holds. Boards are arrays of
+    board codes indexed [x, y], like game.board.codes. """
+import numpy
+
+import pathfinding
+
+def passable(board):
+    """ Returns a boolean array of the cells of _board_ without obstacles. """
+    return ~pathfinding.OBSTACLE_CODES[board]
+
+def shift(cells, axis, step, out):
+    """ Puts _cells_ moved one cell along _axis_, forwards if _step_ is 1
+        or back if it is -1, into _out_, and returns it. """
+    if axis:
+        cells = cells.T
+        out = out.T
+    if step > 0:
+        out[1:] = cells[:-1]
+        out[0] = cells[-1]
+    else:
+        out[:-1] = cells[1:]
+        out[-1] = cells[0]
+    return out.T if axis else out
+
+def spread(cells):
+    """ Returns a boolean array of _cells_ and the cells next to them. """
+    spread = cells.copy()
+    buffer = numpy.empty_like(cells)
+    for axis in (0, 1):
+        for step in (1, -1):
+            spread |= shift(cells, axis, step, buffer)
+    return spread
+
+def reachable(open_cells, start, limit=None):
+    """ Returns a boolean array of the _open_cells_ that can be reached from
+        the cells _start_, which needn't be open themselves, such as a
+        snake's head. If _limit_ is given, filling stops once at least that
+        many cells have been reached. """
+    reached = spread(start) & open_cells
+    count = numpy.count_nonzero(reached)
+    while count and (limit is None or count < limit):
+        reached = spread(reached)
+        reached &= open_cells
+        last_count, count = count, numpy.count_nonzero(reached)
+        if count == last_count:
+            break
+    return reached
+
+def reachable_area(board, x, y, limit=None):
+    """ Returns the number of cells that can be reached from (x, y), or
+        _limit_ if it is given and at least that many can be. """
+    start = numpy.zeros(board.shape, dtype=bool)
+    start[x, y] = True
+    count = numpy.count_nonzero(reachable(passable(board), start, limit))
+    return count if limit is None else min(count, limit)
+
+def territories(board, heads):
+    """ Splits the board between snakes with their heads at _heads_, a list
+        of (x, y), by who can reach each cell first. Returns an array of the
+        index in _heads_ of each cell's owner, -1 for cells nobody reaches
+        and -2 for cells two or more reach at once, and the number of cells
+        each owns. Cells reached at once belong to nobody, and are not
+        spread from. """
+    unclaimed = passable(board)
+    # The owner of each cell claimed in the last step, -1 elsewhere
+    frontier = numpy.empty(board.shape, dtype=numpy.int32)
+    frontier.fill(-1)
+    for i, (x, y) in enumerate(heads):
+        frontier[x, y] = i
+    owners = numpy.empty_like(frontier)
+    owners.fill(-1)
+    buffer = numpy.empty_like(frontier)
+    highest = numpy.empty_like(frontier)
+    lowest = numpy.empty(board.shape, dtype=numpy.uint32)
+    claimed = numpy.empty(board.shape, dtype=bool)
+    owned = numpy.empty(board.shape, dtype=bool)
+    while True:
+        # Seen as unsigned, -1 is above every owner, so that the lowest
+        # owner next door is found along with the highest
+        highest.fill(-1)
+        lowest.fill(-1)
+        for axis in (0, 1):
+            for step in (1, -1):
+                shift(frontier, axis, step, buffer)
+                numpy.maximum(highest, buffer, out=highest)
+                numpy.minimum(lowest, buffer.view(numpy.uint32), out=lowest)
+        numpy.greater_equal(highest, 0, out=claimed)
+        claimed &= unclaimed
+        if not claimed.any():
+            break
+        unclaimed ^= claimed
+        numpy.equal(lowest, highest.view(numpy.uint32), out=owned)
+        owned &= claimed
+        numpy.copyto(owners, -2, where=claimed)
+        numpy.copyto(owners, highest, where=owned)
+        frontier.fill(-1)
+        numpy.copyto(frontier, highest, where=owned)
+    counts = numpy.bincount(owners[owners >= 0], minlength=len(heads))
+    return owners, counts.tolist()
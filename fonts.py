@@ -0,0 +1,47 @@
+""" Fonts loaded once, and rendered text kept for reuse.
+
+    Looking up a system font and rasterizing glyphs are slow, and most text
+    on screen is the same from one frame to the next. """
+from collections import OrderedDict
+
+import pygame
+
+_fonts = {}
+
+def get(name, size, bold=False):
+    """ Returns the system font _name_, loading it on first use. """
+    key = (name, size, bold)
+    font = _fonts.get(key)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = _fonts[key] = pygame.font.SysFont(name, size, bold=bold)
+    return font
+
+class TextCache(object):
+    """ Rendered text surfaces, keyed by font, text and color. The least
+        recently used are dropped once _capacity_ is reached. The surfaces
+        are shared, so they must not be drawn on. """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.surfaces = OrderedDict()
+
+    def render(self, text, name, size, color, bold=False):
+        key = (name, size, bold, text, tuple(color))
+        surface = self.surfaces.pop(key, None)
+        if surface is None:
+            surface = get(name, size, bold).render(text, 1, color)
+            if len(self.surfaces) >= self.capacity:
+                self.surfaces.popitem(last=False)
+        self.surfaces[key] = surface
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+text_cache = TextCache()
+
+def render(text, name, size, color, bold=False):
+    """ Renders antialiased text, reusing the surface if the same text was
+        rendered recently. """
+    return text_cache.render(text, name, size, color, bold)
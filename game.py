@@ -1,24 +1,41 @@
+from array import array
 import ConfigParser
 import multiprocessing
-from ctypes import c_char
-from random import randrange, randint
+from ctypes import c_ubyte
+import random
+from timeit import default_timer as clock
 
+import numpy
 import pygame
 from pygame.locals import *
+
+# Board cell type codes and directions. These are defined before importing
+# game_objects and process, which refer to them as they are loaded.
+EMPTY, WALL, INDESTRUCTABLE_WALL, APPLE, SNAKE, MISSILE = range(6)
+OBSTACLES = frozenset((WALL, INDESTRUCTABLE_WALL, SNAKE, MISSILE))
+LEFT, RIGHT, UP, DOWN = range(4)
+
 import game_objects
 import game_effects
 import process
-serializer = process.Serializer()
+import timings
 
-NAME = "Battle Snake %i" % (randint(3, 9) * 1000)  # Choose a random futuristic-looking year :)
+NAME = "Battle Snake %i" % (game_effects.rng.randint(3, 9) * 1000)  # Choose a random futuristic-looking year :)
 WINDOW_WIDTH = 1280
 WINDOW_HEIGHT = 800
 SCOREBOARD_HEIGHT = 80
+
+# The board size comes from the level, and is set by init_level()
 BOARD_WIDTH = 80
 BOARD_HEIGHT = 45
-CELL_WIDTH = WINDOW_WIDTH / BOARD_WIDTH
-CELL_HEIGHT = (WINDOW_HEIGHT-SCOREBOARD_HEIGHT) / BOARD_HEIGHT
-LEFT, RIGHT, UP, DOWN = range(4)
+
+def get_cell_size(board_width, board_height):
+    """ Returns the largest cell width and height that fit the board in the
+        window, at least one pixel each. """
+    return (max(1, WINDOW_WIDTH / board_width),
+            max(1, (WINDOW_HEIGHT-SCOREBOARD_HEIGHT) / board_height))
+
+CELL_WIDTH, CELL_HEIGHT = get_cell_size(BOARD_WIDTH, BOARD_HEIGHT)
 
 player_controls = {
     0: [K_LEFT, K_RIGHT, K_UP, K_DOWN],
@@ -29,6 +46,14 @@ player_controls = {
 
 num_players = None
 level = None
+
+# All randomness in the simulation comes from this generator, so a game can
+# be reproduced from its seed. Effects have their own in game_effects.
+rng = random.Random()
+rng_seed = None
+tick_count = 0
+recorder = None  # Set to a replay.Recorder to record player input
+tracer = None  # Set to a tracing.Tracer to write a timeline of the game
 # player_colors = {
 #     '1': pygame.Color(0, 255, 0),
 #     '2': pygame.Color(0, 0, 255),
@@ -40,85 +65,250 @@ players = []
 apples = []
 walls = []
 missiles = []
-effects = []
+effects = game_effects.EffectManager()
 log_screen = game_objects.LogScreen()
+wall_layer = None  # The level's walls drawn once, see Level.draw_walls
+TRANSPARENT = pygame.Color(0, 0, 0)  # Color key of layers drawn over the board
 
 # Load config variables
 config = ConfigParser.SafeConfigParser()
 config.read('snake.ini')
 config.read('local.ini')
 
-# Set frame rate
+# The simulation runs at a fixed tick rate, independent of the frame rate.
+# Turbo speeds the game up by turbo_multiplier.
 frames_per_second = config.getint('snake', 'frames_per_second')
+ticks_per_second = config.getint('snake', 'ticks_per_second')
+turbo_multiplier = config.getint('snake', 'turbo_multiplier')
 
-# Set full screen mode
-flags = 0
-if config.getboolean('snake', 'full_screen'):
-    flags |= pygame.FULLSCREEN
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), flags)
+# Explosions and missile trails share one pool of at most particle_budget
+# particles
+particles = game_effects.ParticleSystem(config.getint('snake', 'particle_budget'))
 
 ai_index = config.getint('snake', 'ai_index')
 use_multiprocessing= config.getboolean('snake', 'use_multiprocessing')
+record_replays = config.getboolean('snake', 'record_replays')
+trace = config.getboolean('snake', 'trace')
+
+# Per-phase frame timings, shown over the game. None unless switched on.
+frame_timings = None
+if config.getboolean('snake', 'frame_timings'):
+    frame_timings = timings.FrameTimings()
+
+# Headless games skip rendering, fonts and effects entirely
+headless = False
+screen = None
+
+def init_screen():
+    global screen
+
+    # Set full screen mode
+    flags = 0
+    if config.getboolean('snake', 'full_screen'):
+        flags |= pygame.FULLSCREEN
+    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), flags)
 
 class CollisionError(Exception):
     def __init__(self, collider, collidee):
         self.collider = collider
         self.collidee = collidee
 
-class BoardRow(list):
+class Board(object):
+    """ The game board, indexed as board[x, y].
+
+        Each cell's type code is kept in a typed array in shared memory, which
+        AI processes read through board.codes without any copying. The game
+        objects themselves are kept in a flat list indexed by x*height + y.
+        Snake cells hold their Player, and are read back as a SnakePart.
+
+        The empty cells are indexed in an unordered list, with each cell's
+        position in it, so that a random empty cell can be drawn in constant
+        time. Both are compact integer arrays, which keeps boards of millions
+        of cells small. """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.shared = multiprocessing.RawArray(c_ubyte, width * height)
+        self.codes = numpy.frombuffer(self.shared, dtype=numpy.uint8).reshape(width, height)
+        self.reset()
+
+    def __getitem__(self, key):
+        return self.occupant(*key)
+
+    def occupant(self, x, y):
+        """ Returns the object on a cell, or None if it is empty. Moving
+            objects check the cell they are entering with this and resolve
+            any collision themselves. """
+        occupant = self.objects[x * self.height + y]
+        if occupant is not None and occupant.board_code == SNAKE:
+            return game_objects.SnakePart(occupant, x, y)
+        return occupant
+
+    def holds(self, x, y, obj):
+        """ Returns True if _obj_ itself is on the cell. """
+        return self.objects[x * self.height + y] is obj
+
     def __setitem__(self, key, value):
-        if value and self.__getitem__(key):
-            raise CollisionError(value, self.__getitem__(key))
-        super(BoardRow, self).__setitem__(key, value)
-        shared_board[board.index(self)][key] = serializer.translate_board_obj(value)
+        x, y = key
+        i = x * self.height + y
+        if self.dirty is not None:
+            self.dirty.add(i)
+        if value is None:
+            if wall_layer is not None and self.codes[x, y] == WALL:
+                # However the wall left, it mustn't be drawn with the others
+                wall_layer.fill(TRANSPARENT, (x*CELL_WIDTH, y*CELL_HEIGHT, CELL_WIDTH, CELL_HEIGHT))
+            self.objects[i] = None
+            self.codes[x, y] = EMPTY
+            if self.free_position[i] < 0:
+                self.free_position[i] = len(self.free)
+                self.free.append(i)
+            return
+        if self.objects[i] is not None:
+            raise CollisionError(value, self[x, y])
+        self.objects[i] = value
+        self.codes[x, y] = value.board_code
+
+        # Move the last free cell into this one's place
+        position = self.free_position[i]
+        last = self.free.pop()
+        if last != i:
+            self.free[position] = last
+            self.free_position[last] = position
+        self.free_position[i] = -1
 
-# Board in shared memory used by AI processes
-shared_board = multiprocessing.Array(c_char * BOARD_HEIGHT,
-        ((c_char * BOARD_HEIGHT) * BOARD_WIDTH)())
+    def is_empty(self, x, y):
+        return self.codes[x, y] == EMPTY
 
-board = []
-for i in range(BOARD_WIDTH):
-    board.append(BoardRow([None,] * BOARD_HEIGHT))
+    def num_free(self):
+        return len(self.free)
+
+    def random_free_cell(self, rng):
+        """ Returns the (x, y) of a uniformly chosen empty cell, or None if the
+            board is full. """
+        if not self.free:
+            return None
+        return divmod(self.free[rng.randrange(len(self.free))], self.height)
+
+    def snapshot(self):
+        """ Returns a copy of the cell type codes. """
+        return self.codes.copy()
+
+    def reset(self):
+        size = self.width * self.height
+        self.codes.fill(EMPTY)
+        self.objects = [None] * size
+        self.free = array('i', xrange(size))
+        self.free_position = array('i', xrange(size))
+        self.dirty = None  # Cells changed since a renderer last looked, when one is tracking them
+
+board = Board(BOARD_WIDTH, BOARD_HEIGHT)
 
 def update():
-    for obj in apples + missiles:
-        obj.update()
+    global tick_count
 
-    for player in players:
-        if not player.is_dead:
-            player.update()
+    if tracer is not None:
+        start = clock()
 
-def draw():
-    for drawable in apples + walls + missiles:
-        drawable.draw()
+    if not headless:
+        for apple in apples:
+            apple.update()
+    if frame_timings is not None:
+        frame_timings.lap('apples')
+
+    for missile in missiles[:]:
+        missile.update()
+    if frame_timings is not None:
+        frame_timings.lap('missiles')
 
     for player in players:
         if not player.is_dead:
-            player.draw()
+            player.update()
+    if frame_timings is not None:
+        frame_timings.lap('snakes')
 
-    log_screen.draw()
+    if tracer is not None:
+        tracer.span('tick', start, args={'tick': tick_count})
+    tick_count += 1
 
-def init_level():
-    global players, apples, walls, missiles, effects, board, log_screen
+def init_level(seed=None):
+    global players, apples, walls, missiles, log_screen, rng_seed, tick_count
+    global board, BOARD_WIDTH, BOARD_HEIGHT, CELL_WIDTH, CELL_HEIGHT
 
     players = []
     apples = []
     walls = []
     missiles = []
-    effects = []
-    board = []
+    effects.clear()
+    particles.clear()
     log_screen = game_objects.LogScreen()
 
-    for i in range(BOARD_WIDTH):
-        board.append(BoardRow([None,] * BOARD_HEIGHT))
+    tick_count = 0
+
+    # The board is cleared in place if it keeps its size, since AI processes
+    # hold views of it
+    if (board.width, board.height) == (level.width, level.height):
+        board.reset()
+    else:
+        BOARD_WIDTH, BOARD_HEIGHT = level.width, level.height
+        CELL_WIDTH, CELL_HEIGHT = get_cell_size(BOARD_WIDTH, BOARD_HEIGHT)
+        board = Board(BOARD_WIDTH, BOARD_HEIGHT)
+
+    if seed is None:
+        seed = random.randrange(2**32)
+    rng_seed = seed
+    rng.seed(seed)
 
     # Load level
     level.parse_layout()
 
+def handle_key(key):
+    """ Routes a movement key to the player it belongs to. Returns True if
+        the key was used. """
+    for i, controls in player_controls.items():
+        if key in controls and i < len(players):
+            handle_input(i, controls.index(key))
+            return True
+    return False
+
+def handle_input(player_index, direction):
+    """ Turns or fires for the player in seat _player_index_. AIs submit
+        their moves this way, since only four players have keys. """
+    players[player_index].set_direction(direction)
+
+def get_winners():
+    """ Returns the players that reached the level's kill target, with ties
+        broken by the fewest deaths. """
+    winners = filter(lambda p: len(p.kills) >= level.kills_to_win, players)
+    if winners:
+        least_deaths = min(len(w.deaths) for w in winners)
+        winners = filter(lambda w: len(w.deaths) == least_deaths, winners)
+    return winners
+
+DEATH_CAUSES = ('collision', 'missile', 'wall', 'suicide')
+
+def get_death_causes(player):
+    """ Counts a player's deaths by cause, keyed by the names in
+        DEATH_CAUSES. """
+    causes = dict((cause, 0) for cause in DEATH_CAUSES)
+    for collidee in player.deaths:
+        if isinstance(collidee, (game_objects.SnakePart, game_objects.Missile)):
+            if collidee.player is player:
+                causes['suicide'] += 1
+            elif isinstance(collidee, game_objects.SnakePart):
+                causes['collision'] += 1
+            else:
+                causes['missile'] += 1
+        elif isinstance(collidee, game_objects.Wall):
+            causes['wall'] += 1
+    return causes
+
 def add_apple():
-    try:
-        a = game_objects.Apple(randrange(BOARD_WIDTH), randrange(BOARD_HEIGHT))
-    except CollisionError, ce:
-        add_apple()
-    else:
-        apples.append(a)
+    """ Places an apple on a random empty cell. Returns the apple, or None if
+        the board is full. """
+    cell = board.random_free_cell(rng)
+    if cell is None:
+        log_screen.add('No room for another apple.')
+        return None
+    a = game_objects.Apple(*cell)
+    apples.append(a)
+    return a
@@ -1,18 +1,21 @@
+import random
+
+import numpy
 import pygame
 import game
-import random
+
+# Effects draw from their own generator so they never disturb the game's
+rng = random.Random()
 
 def draw_circle(screen, color, (center_x, center_y), radius, width):
     """Handles alpha transparency"""
-    image = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA, 32)
-    pygame.draw.circle(image, color, (radius, radius), radius, width)
-    screen.blit(image, (center_x-radius, center_y-radius))
+    image = sprites.get(CIRCLE, color, radius, width)
+    return screen.blit(image, (center_x-radius, center_y-radius))
 
 def draw_rect(screen, color, rect, width=0):
     """Handles alpha transparency"""
-    image = pygame.Surface((rect.width, rect.height), pygame.SRCALPHA, 32)
-    pygame.draw.rect(image, color, pygame.Rect(0, 0, rect.width, rect.height), width)
-    screen.blit(image, (rect.left, rect.top))
+    image = sprites.get(RECT, color, (rect.width, rect.height), width)
+    return screen.blit(image, (rect.left, rect.top))
 
 def clone_color(color):
     return pygame.Color(color.r, color.g, color.b, color.a)
@@ -27,71 +30,244 @@ def adjust_brightness(color, multiplier):
             rgb[i] = 0
     return pygame.Color(rgb[0], rgb[1], rgb[2], color.a)
 
-class Explosion(object):
-    def __init__(self, x, y, color, max_speed=15, num_particles=20, particle_size=3, fade_speed=6, particle_type="circle"):
-        self.particles = []  # Each particle holds [x, y, x_speed, y_speed]
-        self.num_particles = num_particles        
-        self.particle_size = particle_size
-        self.particle_type = particle_type
-        self.max_speed = max_speed
-        self.x = x
-        self.y = y
-        self.color = clone_color(color)
-        self.fade_speed = fade_speed
+CIRCLE, RECT = range(2)
 
-        for i in range(self.num_particles):
-            self.particles.append([float(self.x), float(self.y), random.uniform(-self.max_speed, self.max_speed), random.uniform(-self.max_speed, self.max_speed)])
+class SpriteCache(object):
+    """ Shapes pre-rendered on transparent surfaces, so that effects fading
+        through the same colors and alphas never rasterize them twice.
 
-    def draw(self):
-        for p in self.particles:
-            if self.particle_type == "rect":
-                draw_rect(game.screen, self.color, pygame.Rect(p[0], p[1], self.particle_size, self.particle_size))
-            else:
-                draw_circle(game.screen, self.color, (int(p[0]), int(p[1])), self.particle_size, 0)
+        Sprites are keyed by shape, color with alpha, size and outline
+        width, where the size is the radius of a circle or the (width,
+        height) of a rectangle. When _capacity_ sprites are cached, the
+        least recently used quarter of them is dropped at once, which keeps
+        each lookup to a dict access. """
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.sprites = {}  # Key => [sprite, time of last use]
+        self.time = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, shape, color, size, width=0):
+        key = (shape, tuple(color), size, width)
+        self.time += 1
+        entry = self.sprites.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[1] = self.time
+            return entry[0]
+
+        self.misses += 1
+        if len(self.sprites) >= self.capacity:
+            self.evict(max(1, self.capacity / 4))
+        sprite = self.render(shape, color, size, width)
+        self.sprites[key] = [sprite, self.time]
+        return sprite
+
+    def evict(self, count):
+        """ Drops the _count_ least recently used sprites. """
+        by_age = sorted(self.sprites.items(), key=lambda item: item[1][1])
+        for key, entry in by_age[:count]:
+            del self.sprites[key]
+        self.evictions += min(count, len(by_age))
+
+    def render(self, shape, color, size, width):
+        if shape == CIRCLE:
+            sprite = pygame.Surface((size*2, size*2), pygame.SRCALPHA, 32)
+            pygame.draw.circle(sprite, color, (size, size), size, width)
+        else:
+            sprite = pygame.Surface(size, pygame.SRCALPHA, 32)
+            pygame.draw.rect(sprite, color, pygame.Rect((0, 0), size), width)
+        return sprite
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def __str__(self):
+        return '%d sprites, %d hits, %d misses (%.1f%% hit), %d evictions' % (
+                len(self.sprites), self.hits, self.misses, self.hit_rate() * 100, self.evictions)
+
+sprites = SpriteCache()
+
+class ParticleSystem(object):
+    """ Every particle on screen, kept in arrays and moved all at once.
+
+        A particle flies at a constant speed and loses fade alpha each frame,
+        and is removed once its alpha would drop below zero. New particles
+        beyond the budget are not created. """
+    def __init__(self, budget):
+        self.budget = budget
+        self.count = 0
+        self.x = numpy.zeros(budget)
+        self.y = numpy.zeros(budget)
+        self.vx = numpy.zeros(budget)
+        self.vy = numpy.zeros(budget)
+        self.alpha = numpy.zeros(budget, numpy.int16)
+        self.fade = numpy.zeros(budget, numpy.int16)
+        self.size = numpy.zeros(budget, numpy.int16)
+        self.shape = numpy.zeros(budget, numpy.int8)
+        self.color = numpy.zeros(budget, numpy.int16)  # Index into colors
+        self.colors = []  # (r, g, b) of each color used
+        self.color_index = {}
+
+    def __len__(self):
+        return self.count
+
+    def emit(self, x, y, vx, vy, color, size, fade, shape=CIRCLE):
+        """ Adds particles at (x, y) moving at speeds _vx_ and _vy_, which are
+            sequences. Returns how many were added. """
+        n = min(len(vx), self.budget - self.count)
+        if n <= 0:
+            return 0
+        rgb = (color.r, color.g, color.b)
+        if rgb not in self.color_index:
+            self.color_index[rgb] = len(self.colors)
+            self.colors.append(rgb)
+        new = slice(self.count, self.count + n)
+        self.x[new] = x
+        self.y[new] = y
+        self.vx[new] = vx[:n]
+        self.vy[new] = vy[:n]
+        self.alpha[new] = color.a
+        self.fade[new] = fade
+        self.size[new] = size
+        self.shape[new] = shape
+        self.color[new] = self.color_index[rgb]
+        self.count += n
+        return n
 
     def update(self):
-        for p in self.particles:
-            p[0] += p[2]
-            p[1] += p[3]
+        live = slice(0, self.count)
+        self.x[live] += self.vx[live]
+        self.y[live] += self.vy[live]
+        alive = self.alpha[live] >= self.fade[live]
+        self.alpha[live] -= self.fade[live]
+        if not alive.all():
+            keep = numpy.nonzero(alive)[0]
+            for array in (self.x, self.y, self.vx, self.vy, self.alpha,
+                    self.fade, self.size, self.shape, self.color):
+                array[:len(keep)] = array[keep]
+            self.count = len(keep)
+
+    def draw(self, surface):
+        """ Draws the particles and returns the areas drawn. """
+        live = slice(0, self.count)
+        # Circles are centered on their position, squares hang from it
+        offset = numpy.where(self.shape[live] == CIRCLE, self.size[live], 0)
+        left = (self.x[live].astype(int) - offset).tolist()
+        top = (self.y[live].astype(int) - offset).tolist()
+        rects = []
+        blit = surface.blit
+        get_sprite = sprites.get
+        for x, y, shape, color, alpha, size in zip(left, top, self.shape[live].tolist(),
+                self.color[live].tolist(), self.alpha[live].tolist(), self.size[live].tolist()):
+            r, g, b = self.colors[color]
+            if shape == RECT:
+                size = (size, size)
+            rects.append(blit(get_sprite(shape, (r, g, b, alpha), size), (x, y)))
+        return rects
+
+    def clear(self):
+        self.count = 0
+
+def explode(x, y, color, max_speed=15, num_particles=20, particle_size=3, fade_speed=6, particle_type="circle"):
+    """ Bursts particles out of (x, y) in random directions. """
+    speeds = [rng.uniform(-max_speed, max_speed) for i in range(num_particles * 2)]
+    game.particles.emit(x, y, speeds[0::2], speeds[1::2], color, particle_size, fade_speed,
+            RECT if particle_type == "rect" else CIRCLE)
+
+class EffectManager(object):
+    """ The effects on screen, updated and drawn once per frame.
+
+        Retiring an effect only marks it: it stops updating and drawing at
+        once, and is taken out at the start or end of the next update by
+        moving the last effect into its slot. So effects can be retired while
+        the effects are being updated, and neither adding nor retiring one
+        searches the list. Retired effects are kept in a pool per class and
+        reused by spawn(), through their reset method. """
+    def __init__(self):
+        self.effects = []
+        self.retired = []
+        self.pools = {}
+
+    def __len__(self):
+        return len(self.effects)
 
-        # Decrease alpha of particle
-        if self.color.a < self.fade_speed:
-            game.effects.remove(self)
+    def spawn(self, cls, *args):
+        """ Returns a new effect of class _cls_, made with _args_. """
+        pool = self.pools.get(cls)
+        if pool:
+            effect = pool.pop()
+            effect.reset(*args)
         else:
-            self.color.a -= self.fade_speed
+            effect = cls(*args)
+        effect.slot = len(self.effects)
+        effect.is_retired = False
+        self.effects.append(effect)
+        return effect
+
+    def retire(self, effect):
+        if not effect.is_retired:
+            effect.is_retired = True
+            self.retired.append(effect)
+
+    def update(self):
+        self._remove_retired()
+        # Effects spawned during the update are appended, and updated too
+        for effect in self.effects:
+            if not effect.is_retired:
+                effect.update()
+        self._remove_retired()
+
+    def draw(self):
+        """ Draws the effects on the screen, returning the areas drawn. """
+        rects = []
+        for effect in self.effects:
+            if not effect.is_retired:
+                rects.extend(effect.draw())
+        return rects
+
+    def clear(self):
+        """ Retires every effect, for a new level. """
+        for effect in self.effects:
+            self.retire(effect)
+        self._remove_retired()
+
+    def _remove_retired(self):
+        effects = self.effects
+        for effect in self.retired:
+            last = effects.pop()
+            if last is not effect:
+                effects[effect.slot] = last
+                last.slot = effect.slot
+            effect.slot = None
+            self.pools.setdefault(type(effect), []).append(effect)
+        self.retired = []
 
 class ParticleTrail(object):
+    """ Leaves particles behind a moving object. """
     def __init__(self, followed_object, color):
+        self.reset(followed_object, color)
+
+    def reset(self, followed_object, color):
         self.followed_object = followed_object
         self.color = clone_color(color)
         self.trail_density = 1
-        self.particles = []
         self.particle_radius = 2
         self.particle_speed = 2
         self.fade_speed = 10
 
     def draw(self):
-        for particle in self.particles:
-            draw_circle(game.screen, particle['color'], (particle['x'], particle['y']), self.particle_radius, 0)
+        """ The particles are drawn by game.particles. """
+        return []
 
     def update(self):
-        for i in range(self.trail_density):
-            self.particles.append({
-                "x": self.followed_object.rect.centerx, 
-                "y": self.followed_object.rect.centery, 
-                "vx": random.uniform(-self.particle_speed, self.particle_speed), 
-                "vy": random.uniform(-self.particle_speed, self.particle_speed), 
-                "color": clone_color(self.color)
-                })
-
-        for particle in self.particles:
-            particle['x'] += particle['vx']
-            particle['y'] += particle['vy']
-
-            if particle['color'].a < self.fade_speed:
-                self.particles.remove(particle)
-            else:
-                particle['color'].a -= self.fade_speed
+        speeds = [rng.uniform(-self.particle_speed, self.particle_speed) for i in range(self.trail_density * 2)]
+        center = self.followed_object.rect.center
+        game.particles.emit(center[0], center[1], speeds[0::2], speeds[1::2], self.color,
+                self.particle_radius, self.fade_speed)
 
 # class FadingText(object):
 #     def __init__(self, text, x, y, color):
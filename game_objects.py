@@ -1,5 +1,6 @@
 from collections import deque
 import pygame
+import fonts
 import game
 import game_effects
 import time
@@ -10,29 +11,48 @@ class GameObject(object):
         self.y = y
         self.width = game.CELL_WIDTH
         self.height = game.CELL_HEIGHT
-        self.rect = pygame.Rect(x*self.width, y*self.height, self.width, self.height)
         self.color = color
 
-        game.board[x][y] = self
+        game.board[x, y] = self
 
-    def draw(self):
-        pygame.draw.rect(game.screen, self.color, self.rect)
+    @property
+    def rect(self):
+        return pygame.Rect(self.x*self.width, self.y*self.height, self.width, self.height)
+
+    def draw(self, surface=None):
+        if surface is None:
+            surface = game.screen
+        pygame.draw.rect(surface, self.color, self.rect)
 
     def update(self):
         raise NotImplementedError('Not implemented')
 
     def remove_from_board(self):
-        game.board[self.x][self.y] = None
+        game.board[self.x, self.y] = None
 
 class SnakePart(GameObject):
-    def __init__(self, player, x, y, color):
-        super(SnakePart, self).__init__(x, y, color)
+    """ A view of one cell of a snake. Snakes keep their bodies as coordinates
+        and the board holds the Player itself, so parts are only created when
+        something asks what is on a cell. """
+    board_code = game.SNAKE
+
+    def __init__(self, player, x, y):
         self.player = player
+        self.x = x
+        self.y = y
+        self.width = game.CELL_WIDTH
+        self.height = game.CELL_HEIGHT
+
+    @property
+    def color(self):
+        return self.player.color
 
     def is_head(self):
         return (self.x, self.y) == (self.player.x, self.player.y)
 
     def become_missile(self, x, y, direction):
+        """ Launches this part from the cell ahead of (x, y). Returns the
+            missile, or None if the cell is taken. """
         self.remove_from_board()
         if direction == game.LEFT:
             x -= 1
@@ -52,15 +72,26 @@ class SnakePart(GameObject):
             y = game.BOARD_HEIGHT-1
         if y >= game.BOARD_HEIGHT:
             y = 0
-        return Missile(self.player, x, y, direction, self.color)
+
+        collidee = game.board.occupant(x, y)
+        if collidee is None:
+            return Missile(self.player, x, y, direction, self.color)
+        if isinstance(collidee, Missile):
+            # Could not create missile because a missile is already there
+            # Reattach part
+            self.player.body.appendleft((self.x, self.y))
+        return None
 
 class Missile(GameObject):
+    board_code = game.MISSILE
+
     def __init__(self, player, x, y, direction, color):
         super(Missile, self).__init__(x, y, game_effects.adjust_brightness(color, 0.5))
         self.player = player
         self.direction = direction
-        self.particle_trail = game_effects.ParticleTrail(self, self.color)
-        game.effects.append(self.particle_trail)
+        self.particle_trail = None
+        if not game.headless:
+            self.particle_trail = game.effects.spawn(game_effects.ParticleTrail, self, self.color)
         self.is_destroyed = False
 
     def update(self):
@@ -87,36 +118,42 @@ class Missile(GameObject):
         if self.y >= game.BOARD_HEIGHT:
             self.y = 0
 
-        # Keep rect object up to date
-        self.rect = pygame.Rect(self.x*self.width, self.y*self.height, self.width, self.height)
-
         # Update game board
-        if game.board[_x][_y] == self:
-            game.board[_x][_y] = None
-        try:
-            game.board[self.x][self.y] = self
-        except game.CollisionError, ce:
-            if isinstance(ce.collidee, Missile):
-                ce.collidee.cleanup()
-                ce.collidee.remove_from_board()
-            elif isinstance(ce.collidee, Wall):
-                ce.collidee.remove_from_board()
-                game.effects.append(game_effects.Explosion(ce.collidee.rect.centerx, ce.collidee.rect.centery, ce.collidee.color, max_speed=6, num_particles=5, particle_size=5, fade_speed=12))
-            elif isinstance(ce.collidee, SnakePart):
-                player = ce.collidee.player
-                if (player.x, player.y) == (ce.collidee.x, ce.collidee.y):
-                    player.kill(self)
-            elif isinstance(ce.collidee, Apple):
-                return
-            self.cleanup()
+        if game.board.holds(_x, _y, self):
+            game.board[_x, _y] = None
+        collidee = game.board.occupant(self.x, self.y)
+        if collidee is None:
+            game.board[self.x, self.y] = self
+            return
+        if game.tracer is not None:
+            game.tracer.instant('collision', args={'object': 'missile', 'player': self.player.name, 'with': type(collidee).__name__, 'x': self.x, 'y': self.y})
+
+        if isinstance(collidee, Missile):
+            collidee.cleanup()
+            collidee.remove_from_board()
+        elif isinstance(collidee, Wall):
+            collidee.remove_from_board()
+            if not game.headless:
+                game_effects.explode(collidee.rect.centerx, collidee.rect.centery, collidee.color, max_speed=6, num_particles=5, particle_size=5, fade_speed=12)
+        elif isinstance(collidee, SnakePart):
+            player = collidee.player
+            if (player.x, player.y) == (collidee.x, collidee.y):
+                player.kill(self)
+        elif isinstance(collidee, Apple):
+            return
+        self.cleanup()
 
     def cleanup(self):
         self.is_destroyed = True
         game.missiles.remove(self)
-        game.effects.remove(self.particle_trail)
-        game.effects.append(game_effects.Explosion(self.rect.centerx, self.rect.centery, self.color, max_speed=15, num_particles=5, particle_size=4, fade_speed=10))
+        if not game.headless:
+            game.effects.retire(self.particle_trail)
+            self.particle_trail = None
+            game_effects.explode(self.rect.centerx, self.rect.centery, self.color, max_speed=15, num_particles=5, particle_size=4, fade_speed=10)
 
 class Apple(GameObject):
+    board_code = game.APPLE
+
     def __init__(self, x, y):
         super(Apple, self).__init__(x, y, pygame.Color(255, 0, 0))
         self.color_change = 4
@@ -126,11 +163,15 @@ class Apple(GameObject):
         if self.color.g > 200 or self.color.g == 0:
             self.color_change *= -1
 
-    def draw(self):
+    def draw(self, surface=None):
+        if surface is None:
+            surface = game.screen
         radius = int(self.rect.width/2+1)  # Expand the diameter to the length of the diagonal
-        pygame.draw.circle(game.screen, self.color, self.rect.center, radius)
+        pygame.draw.circle(surface, self.color, self.rect.center, radius)
 
 class Wall(GameObject):
+    board_code = game.WALL
+
     def __init__(self, x, y):
         super(Wall, self).__init__(x, y, pygame.Color(139, 69, 0))
 
@@ -139,6 +180,8 @@ class Wall(GameObject):
         game.walls.remove(self)
 
 class IndestructableWall(GameObject):
+    board_code = game.INDESTRUCTABLE_WALL
+
     def __init__(self, x, y):
         super(IndestructableWall, self).__init__(x, y, pygame.Color(99, 39, 20))
 
@@ -146,6 +189,8 @@ class IndestructableWall(GameObject):
         pass
 
 class Player(object):
+    board_code = game.SNAKE
+
     def __init__(self, name, player_number, x, y, direction, color):
         self.name = name
         self.player_number = player_number
@@ -155,48 +200,45 @@ class Player(object):
         self.direction = direction
         self.spawn_coordinates = (x, y)
         self.spawn_direction = direction
-        self.parts = deque()
-        self.parts.append(SnakePart(self, self.x, self.y, color))
+        self.body = deque()  # Coordinates from the tail to the head
+        self.body.append((x, y))
+        game.board[x, y] = self
         self.grow = False
         self.is_dead = False
-        self.frames_until_update_position = 3
-        self.frame_count = 1
+        self.ticks_until_update_position = 3
+        self.tick_count = 1
         self._lock_set_direction = False
         self.is_invincible = False
         self.is_invisible = False
-        self.invincible_frame_count = 0
+        self.invincible_tick_count = 0
         self.deaths = []  # Array of things that collided with player
         self.kills = []  # Array of players you've killed
         self.AI_engine = None
         self.onkill = None  # Get's set by an AI player - executes when you get killed
 
     def get_length(self):
-        return len(self.parts)
+        return len(self.body)
 
     def respawn(self):
-        part = self.parts.pop()
-        part.x, part.y = self.spawn_coordinates
-        part.rect = pygame.Rect(part.x*part.width, part.y*part.height,
-                part.width, part.height)
         self.x, self.y = self.spawn_coordinates
         self.direction = self.spawn_direction
-        self.parts.clear()
-        self.parts.append(part)
+        self.body.clear()
+        self.body.append(self.spawn_coordinates)
         self.is_dead = False
         self.is_invincible = True
         self._lock_set_direction = False
 
     def update(self):
-        if self.frame_count < self.frames_until_update_position:
-            self.frame_count += 1
+        if self.tick_count < self.ticks_until_update_position:
+            self.tick_count += 1
         else:
             self.update_position()
-            self.frame_count = 1
+            self.tick_count = 1
 
         if self.is_invincible:
-            self.invincible_frame_count += 1
-            if self.invincible_frame_count == 4:
-                self.invincible_frame_count = 0
+            self.invincible_tick_count += 1
+            if self.invincible_tick_count == 4:
+                self.invincible_tick_count = 0
                 self.is_invisible = not self.is_invisible
 
     def update_position(self):
@@ -220,48 +262,46 @@ class Player(object):
             self.y = 0
 
         if self.is_invincible:
-            if isinstance(game.board[self.x][self.y], Apple):
+            if game.board.codes[self.x, self.y] == game.APPLE:
                 self.is_invincible = False
             else:
-                head = self.parts[0]
-                head.x, head.y = self.x, self.y
-                head.rect = pygame.Rect(head.x*head.width, head.y*head.height,
-                        head.width, head.height)
+                self.body[0] = (self.x, self.y)
                 self._lock_set_direction = False
                 return
 
         # Update game board
-        try:
-            head = SnakePart(self, self.x, self.y, self.color)
-            self.parts.append(head)
-        except game.CollisionError, ce:
-            if isinstance(ce.collidee, Apple):
-                game.apples.remove(ce.collidee)
-                ce.collidee.remove_from_board()
-                self.grow = True
-                # if self.player_number == 0:
-                #     self.grow = False
-                head = SnakePart(self, self.x, self.y, self.color)
-                self.parts.append(head)
-                game.add_apple()
-                game.log_screen.add("%s grew to %s blocks." % (self.name, len(self.parts)))
-            else:
-                self.kill(ce.collidee)
-                if isinstance(ce.collidee, Missile):
-                    ce.collidee.cleanup()
-                    ce.collidee.remove_from_board()
-                elif isinstance(ce.collidee, SnakePart):
-                    player = ce.collidee.player
-                    if (player.x, player.y) == (ce.collidee.x, ce.collidee.y):
-                        player.kill(self.parts[0])
-                return
+        collidee = game.board.occupant(self.x, self.y)
+        if collidee is None:
+            game.board[self.x, self.y] = self
+            self.body.append((self.x, self.y))
+        elif isinstance(collidee, Apple):
+            game.apples.remove(collidee)
+            collidee.remove_from_board()
+            self.grow = True
+            # if self.player_number == 0:
+            #     self.grow = False
+            game.board[self.x, self.y] = self
+            self.body.append((self.x, self.y))
+            game.add_apple()
+            game.log_screen.add("%s grew to %s blocks." % (self.name, len(self.body)))
+        else:
+            if game.tracer is not None:
+                game.tracer.instant('collision', args={'object': 'snake', 'player': self.name, 'with': type(collidee).__name__, 'x': self.x, 'y': self.y})
+            self.kill(collidee)
+            if isinstance(collidee, Missile):
+                collidee.cleanup()
+                collidee.remove_from_board()
+            elif isinstance(collidee, SnakePart):
+                player = collidee.player
+                if (player.x, player.y) == (collidee.x, collidee.y):
+                    player.kill(SnakePart(self, *self.body[0]))
+            return
 
         # Pop the tail
         if self.grow:
             self.grow = False
         else:
-            end = self.parts.popleft()
-            end.remove_from_board()
+            game.board[self.body.popleft()] = None
 
         # Reset any locks
         self._lock_set_direction = False
@@ -273,11 +313,13 @@ class Player(object):
         self.deaths.append(collidee)
 
         self.is_dead = True
-        for part in self.parts:
-            part.remove_from_board()
+        for cell in self.body:
+            game.board[cell] = None
 
         # Show explosion
-        game.effects.append(game_effects.Explosion(self.parts[-1].rect.left, self.parts[-1].rect.top, self.color, max_speed=22, num_particles=20, particle_size=5, fade_speed=6))
+        if not game.headless:
+            head_x, head_y = self.body[-1]
+            game_effects.explode(head_x*game.CELL_WIDTH, head_y*game.CELL_HEIGHT, self.color, max_speed=22, num_particles=20, particle_size=5, fade_speed=6)
 
         # Log it!
         log_text = self.name + " died!"
@@ -301,12 +343,18 @@ class Player(object):
         game.log_screen.add(log_text)
         self.respawn()
 
-    def draw(self):
-        if self.is_invincible and self.is_invisible:
+    def is_visible(self):
+        """ Invincible snakes blink. """
+        return not (self.is_invincible and self.is_invisible)
+
+    def draw(self, surface=None):
+        if surface is None:
+            surface = game.screen
+        if not self.is_visible():
             return
 
-        for part in self.parts:
-            part.draw()
+        for x, y in self.body:
+            pygame.draw.rect(surface, self.color, (x*game.CELL_WIDTH, y*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT))
 
             # Draw a rounded head
             # if part is self.parts[-1]:
@@ -323,43 +371,48 @@ class Player(object):
 
     def fire(self):
         """ Fires a snakepart """
-        if len(self.parts) > 1:
-            part = self.parts.popleft()  # Remove from the tail
-            try:
-                missile = part.become_missile(self.x, self.y, self.direction)  # Move missile to the head
+        if len(self.body) > 1:
+            part = SnakePart(self, *self.body.popleft())  # Remove from the tail
+            missile = part.become_missile(self.x, self.y, self.direction)  # Move missile to the head
+            if missile is not None:
                 game.missiles.append(missile)
                 game.log_screen.add('%s fired a missile!' % self.name)
-            except game.CollisionError, ce:
-                if isinstance(ce.collidee, Missile):
-                    # Could not create missile because a missile is already there
-                    # Reattach part
-                    self.parts.appendleft(part)
+
+    def grow_on_next_move(self):
+        if game.recorder is not None:
+            game.recorder.record_grow(self.player_number)
+        self.grow = True
 
     def set_direction(self, direction):
         if self.is_dead or self._lock_set_direction:
             return
 
         if direction == self.direction:
+            if game.recorder is not None:
+                game.recorder.record_direction(self.player_number, direction)
             self.fire()
         elif (direction == game.LEFT and self.direction != game.RIGHT) or \
             (direction == game.RIGHT and self.direction != game.LEFT) or \
             (direction == game.UP and self.direction != game.DOWN) or \
             (direction == game.DOWN and self.direction != game.UP):
+            if game.recorder is not None:
+                game.recorder.record_direction(self.player_number, direction)
             self.direction = direction
             self._lock_set_direction = True
 
 class LogScreen(object):
     def __init__(self):
-        pygame.font.init()
-        self.font = pygame.font.SysFont("verdana", 12)
         self.log = deque()
         self.log_size = 5
 
     def draw(self):
+        """ Draws the log on the screen and returns the areas drawn. """
+        rects = []
         for i, text in enumerate(self.log):
-            text = self.font.render(text, 1, (255, 255, 255))
+            text = fonts.render(text, "verdana", 12, (255, 255, 255))
             textpos = text.get_rect(top = 30 + i*20, right = game.WINDOW_WIDTH-30)
-            game.screen.blit(text, textpos)
+            rects.append(game.screen.blit(text, textpos))
+        return rects
 
     def add(self, text):
         self.log.append(text)
@@ -0,0 +1,116 @@
+""" Runs AI matches without a display. The simulation is stepped as fast as the
+    CPU allows, with rendering, fonts and effects switched off. """
+import argparse
+import Queue
+import time
+
+import game
+import level
+import process
+import replay
+from ai_vincent import VincentAI
+from ai_jason import JasonAI
+from ai_jameel import JameelAI
+
+ai_classes = {
+    'vincent': VincentAI,
+    'jason': JasonAI,
+    'jameel': JameelAI,
+}
+
+class Match(object):
+    """ A single game between AI players, stepped one tick at a time. """
+    def __init__(self, level, ai_engines, max_ticks=None, seed=None, record=False):
+        game.headless = True
+        game.level = level
+        game.num_players = len(ai_engines)
+        game.init_level(seed)
+        game.recorder = None
+        if record:
+            replay.start_recording()
+
+        self.max_ticks = max_ticks
+        self.ticks = 0
+        self.input_queue = Queue.Queue()
+        self.shared_state = process.SharedState()
+        self.ai_processes = process.create_ai_processes(ai_engines,
+                self.shared_state, self.input_queue)
+
+    def tick(self):
+        # Apply moves submitted by the AIs during the last tick
+        while True:
+            try:
+                game.handle_input(*self.input_queue.get_nowait())
+            except Queue.Empty, qe:
+                break
+
+        process.execute_ai_processes(self.ai_processes)
+        game.update()
+        self.shared_state.update()
+        self.ticks += 1
+
+    def is_over(self):
+        if self.max_ticks is not None and self.ticks >= self.max_ticks:
+            return True
+        return bool(game.get_winners())
+
+    def run(self):
+        """ Plays until someone wins or the tick limit is reached. Returns the
+            list of winners, which is empty if time ran out. """
+        while not self.is_over():
+            self.tick()
+        return game.get_winners()
+
+def parse_seed(value):
+    """ Reads a --seed, which must fit the four bytes replays store it in. """
+    seed = int(value)
+    if not 0 <= seed < 2**32:
+        raise argparse.ArgumentTypeError('%s is not from 0 to %d' % (value, 2**32 - 1))
+    return seed
+
+def main():
+    parser = argparse.ArgumentParser(description='Run AI matches without a display.')
+    parser.add_argument('--level', default='levels/level1.ini',
+            help='level file to play')
+    parser.add_argument('--ai', nargs='+', choices=sorted(ai_classes),
+            default=['vincent', 'jason', 'jameel', 'jason'],
+            help='AI for each seat, in player order')
+    parser.add_argument('--matches', type=int, default=1,
+            help='number of matches to play')
+    parser.add_argument('--max-ticks', type=int, default=30000,
+            help='ticks before a match is called a draw')
+    parser.add_argument('--seed', type=parse_seed,
+            help='random seed of the first match, incremented for each match after it')
+    parser.add_argument('--record', metavar='DIR',
+            help='save a replay of each match in this directory')
+    args = parser.parse_args()
+
+    lvl = level.Level(args.level)
+    engines = [ai_classes[name] for name in args.ai]
+    total_ticks = 0
+    start_time = time.time()
+
+    for i in range(args.matches):
+        match_start = time.time()
+        seed = None if args.seed is None else (args.seed + i) % 2**32
+        match = Match(lvl, engines, max_ticks=args.max_ticks, seed=seed,
+                record=bool(args.record))
+        winners = match.run()
+        elapsed = time.time() - match_start
+        total_ticks += match.ticks
+        if args.record:
+            print 'Saved', replay.save_recording(args.record)
+
+        if len(winners) == 1:
+            result = winners[0].name + ' wins'
+        else:
+            result = 'Draw'
+        print 'Match %d: %s after %d ticks (%.2fs, %d ticks/s)' % (i + 1,
+                result, match.ticks, elapsed, match.ticks / max(elapsed, 1e-9))
+
+    elapsed = time.time() - start_time
+    print '%d ticks in %.2fs: %d ticks/s' % (total_ticks, elapsed,
+            total_ticks / max(elapsed, 1e-9))
+
+if __name__ == '__main__':
+    main()
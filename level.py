@@ -20,31 +20,86 @@ directions = {
     'down': 3,
 }
 
+def get_player_color(number):
+    """ Returns the color of player _number_, counting from 1. Players after
+        the fourth get hues spread around the color wheel. """
+    if str(number) in player_colors:
+        return player_colors[str(number)]
+    color = pygame.Color(0, 0, 0)
+    color.hsva = (number * 137.508 % 360, 80, 100, 100)
+    return color
+
 class Level(object):
+    """ A level file. The board size is taken from the layout unless width
+        and height are given in [snake]; cells outside the layout are empty.
+        Players 1 to 4 can be placed in the layout, and any number of
+        players in a [spawns] section as
+            number = x, y, direction """
     def __init__(self, config_file):
         config = ConfigParser.SafeConfigParser()
         config.read(config_file)
 
+        self.config_file = config_file
+
         self.num_apples = config.getint('snake', 'num_apples')
         self.name = config.get('snake', 'name')
         self.kills_to_win = config.getint('snake', 'kills_to_win')
-        self.layout = config.get('level', 'layout')
+        self.layout = ''
+        if config.has_option('level', 'layout'):
+            self.layout = config.get('level', 'layout')
+        rows = self.layout.split('\n')[1:]
 
-        self.player_directions = dict((key, directions.get(value)) for key, value in config.items('player_directions'))
+        if config.has_option('snake', 'width'):
+            self.width = config.getint('snake', 'width')
+            self.height = config.getint('snake', 'height')
+        else:
+            self.width = max(len(row) for row in rows)
+            self.height = len(rows)
 
-    def parse_layout(self):
-        layout = self.layout.split('\n')[1:]
-        for y, row in enumerate(layout):
+        self.player_directions = {}
+        if config.has_section('player_directions'):
+            self.player_directions = dict((key, directions.get(value)) for key, value in config.items('player_directions'))
+
+        # Walls and spawn points, in the order they are put on the board
+        self.placements = []  # List of (x, y, board code, player number)
+        for y, row in enumerate(rows):
             for x, column in enumerate(row):
                 if column == 'W':
-                    game.walls.append(game_objects.Wall(x, y))
+                    self.placements.append((x, y, game.WALL, None))
                 if column == 'I':
-                    game.walls.append(game_objects.IndestructableWall(x, y))
+                    self.placements.append((x, y, game.INDESTRUCTABLE_WALL, None))
                 elif column in ('1', '2', '3', '4'):
-                    if int(column) <= game.num_players:
-                        game.players.append(game_objects.Player('Player %s' % column, int(column)-1, x, y, self.player_directions[column], player_colors[column]))
+                    self.placements.append((x, y, game.SNAKE, int(column)))
+        if config.has_section('spawns'):
+            for key, value in sorted(config.items('spawns'), key=lambda item: int(item[0])):
+                x, y, direction = [v.strip() for v in value.split(',')]
+                self.player_directions[key] = directions.get(direction)
+                self.placements.append((int(x), int(y), game.SNAKE, int(key)))
+        self.num_spawns = sum(1 for placement in self.placements if placement[2] == game.SNAKE)
+
+    def parse_layout(self):
+        for x, y, code, number in self.placements:
+            if code == game.WALL:
+                game.walls.append(game_objects.Wall(x, y))
+            elif code == game.INDESTRUCTABLE_WALL:
+                game.walls.append(game_objects.IndestructableWall(x, y))
+            elif number <= game.num_players:
+                game.players.append(game_objects.Player('Player %d' % number, number-1, x, y, self.player_directions[str(number)], get_player_color(number)))
+        game.wall_layer = None if game.headless else self.draw_walls()
         for i in range(self.num_apples):
             game.add_apple()
 
+    def draw_walls(self):
+        """ Returns the walls drawn on a transparent layer the size of the
+            board area, so they can be drawn with a single blit. A wall's cell
+            is erased from it when the board cell is cleared, however that
+            happens. """
+        layer = pygame.Surface((game.WINDOW_WIDTH, game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT))
+        layer.fill(game.TRANSPARENT)
+        for wall in game.walls:
+            wall.draw(layer)
+        layer.set_colorkey(game.TRANSPARENT, pygame.RLEACCEL)
+        return layer
+
 def get_levels():
-    return [Level(os.path.join('levels', level_file)) for level_file in os.listdir('levels')]
+    return [Level(os.path.join('levels', level_file)) for level_file in sorted(os.listdir('levels'))]
@@ -0,0 +1,355 @@
+""" Path search on the board, shared by the AIs.
+
+    Cells are flat indices into the board, x*height + y as in game.Board,
+    and the board wraps around at its edges. Searches are A* over a table
+    of every cell's neighbors, worked out once per board size, with the open
+    cells in an indexed binary heap so that finding one or lowering its key
+    never scans the heap. What blocks a path, the costs, the heuristic and
+    how goals are chosen come from each AI.
+
+    A Grid also works out distance fields, every cell's distance to the
+    nearest of some cells by breadth-first search, which a path can follow
+    downhill without searching. """
+from array import array
+from timeit import default_timer as clock
+
+import numpy
+
+import game
+
+DIRECTIONS = (game.LEFT, game.RIGHT, game.UP, game.DOWN)
+OPPOSITE_DIRECTIONS = (game.RIGHT, game.LEFT, game.DOWN, game.UP)
+
+# Board codes that block a path
+OBSTACLE_CODES = numpy.array([code in game.OBSTACLES for code in range(max(game.OBSTACLES) + 1)])
+
+class Grid(object):
+    """ The cells of a board of one size and their neighbors. """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+
+        # neighbors[4*cell + direction] is the cell next door in that direction
+        table = array('i', [0]) * (4 * self.size)
+        for x in range(width):
+            for y in range(height):
+                i = 4 * (x*height + y)
+                table[i + game.LEFT] = (x-1) % width * height + y
+                table[i + game.RIGHT] = (x+1) % width * height + y
+                table[i + game.UP] = x*height + (y-1) % height
+                table[i + game.DOWN] = x*height + (y+1) % height
+        self.neighbors = table.tolist()
+        # adjacent[cell] is the tuple of the cells next door
+        self.adjacent = zip(*[iter(self.neighbors)] * 4)
+
+    def index(self, x, y):
+        return x*self.height + y
+
+    def coordinates(self, cell):
+        return divmod(cell, self.height)
+
+    def neighbor(self, cell, direction):
+        return self.neighbors[4*cell + direction]
+
+    def direction(self, cell, next_cell):
+        """ Returns the direction of _next_cell_ from its neighbor _cell_. """
+        return self.adjacent[cell].index(next_cell)
+
+    def distance(self, cell1, cell2):
+        """ Returns the least number of steps between two cells, ignoring
+            obstacles. """
+        x1, y1 = divmod(cell1, self.height)
+        x2, y2 = divmod(cell2, self.height)
+        dx = abs(x1 - x2)
+        dy = abs(y1 - y2)
+        return min(dx, self.width - dx) + min(dy, self.height - dy)
+
+    def distances(self, cell):
+        """ Returns the distance of every cell from _cell_, as a numpy array
+            indexed by cell. """
+        x, y = divmod(cell, self.height)
+        dx = numpy.abs(numpy.arange(self.width) - x)
+        dy = numpy.abs(numpy.arange(self.height) - y)
+        dx = numpy.minimum(dx, self.width - dx)
+        dy = numpy.minimum(dy, self.height - dy)
+        return (dx[:, numpy.newaxis] + dy).ravel()
+
+    def rect(self, cell):
+        """ Returns the area of the screen a cell is drawn in, for showing a
+            search. """
+        x, y = divmod(cell, self.height)
+        return (x*game.CELL_WIDTH, y*game.CELL_HEIGHT, game.CELL_WIDTH, game.CELL_HEIGHT)
+
+    def obstacles_nearby(self, board):
+        """ Returns the number of obstacles on _board_, an array of board
+            codes, in the 3x3 square around every cell, the cell included,
+            as a numpy array indexed by cell. Added to a heuristic, it keeps
+            paths away from obstacles. """
+        # Summed along each axis in turn, so that a square is six shifts
+        counts = OBSTACLE_CODES[board].astype(int)
+        counts = counts + numpy.roll(counts, 1, 0) + numpy.roll(counts, -1, 0)
+        counts = counts + numpy.roll(counts, 1, 1) + numpy.roll(counts, -1, 1)
+        return counts.ravel()
+
+    def distance_field(self, sources, board):
+        """ Returns the number of steps from every cell to the nearest of
+            the cells _sources_, going round the obstacles on _board_, an
+            array of board codes, as a list indexed by cell. Obstacles are
+            -2, and cells that can't be reached -1. """
+        adjacent = self.adjacent
+        distances = numpy.where(OBSTACLE_CODES[board.ravel()], -2, -1).tolist()
+        frontier = []
+        for cell in sources:
+            if distances[cell] == -1:
+                distances[cell] = 0
+                frontier.append(cell)
+        distance = 0
+        while frontier:
+            distance += 1
+            next_frontier = []
+            append = next_frontier.append
+            for cell in frontier:
+                for neighbor in adjacent[cell]:
+                    if distances[neighbor] == -1:
+                        distances[neighbor] = distance
+                        append(neighbor)
+            frontier = next_frontier
+        return distances
+
+    def descend(self, distances, start, behind=None):
+        """ Returns the cells after _start_ on a shortest path down
+            _distances_ to one of its sources, or None if no neighbor of
+            _start_ other than _behind_ leads to one. Each step goes to the
+            first neighbor, in the order of DIRECTIONS, one step closer. """
+        adjacent = self.adjacent
+        best = None
+        for neighbor in adjacent[start]:
+            distance = distances[neighbor]
+            if distance >= 0 and neighbor != behind and (best is None or distance < distances[best]):
+                best = neighbor
+        if best is None:
+            return None
+        path = [best]
+        cell = best
+        distance = distances[cell]
+        while distance > 0:
+            distance -= 1
+            for neighbor in adjacent[cell]:
+                if distances[neighbor] == distance:
+                    cell = neighbor
+                    break
+            path.append(cell)
+        return path
+
+    def blocked(self, board):
+        """ Returns a list telling for each cell whether _board_, an array of
+            board codes, has an obstacle there. """
+        return OBSTACLE_CODES[board.ravel()].tolist()
+
+_grids = {}
+
+def get_grid(width, height):
+    """ Returns the Grid for a board size, made on first use. """
+    grid = _grids.get((width, height))
+    if grid is None:
+        grid = _grids[(width, height)] = Grid(width, height)
+    return grid
+
+class IndexedHeap(object):
+    """ A binary min-heap of cells ordered by key, which keeps track of where
+        each cell is so that it can be looked up and have its key lowered in
+        place. Cells are pushed and popped in the same order heapq would
+        order (key, cell) pairs compared on the key alone. """
+    def __init__(self, size):
+        self.keys = []
+        self.cells = []
+        self.positions = [-1] * size
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return self.positions[cell] >= 0
+
+    def push(self, cell, key):
+        self.keys.append(key)
+        self.cells.append(cell)
+        self.positions[cell] = len(self.cells) - 1
+        self._sift_down(0, len(self.cells) - 1)
+
+    def pop(self):
+        """ Removes and returns the cell with the lowest key. """
+        keys, cells, positions = self.keys, self.cells, self.positions
+        last_key = keys.pop()
+        last_cell = cells.pop()
+        if not cells:
+            positions[last_cell] = -1
+            return last_cell
+        cell = cells[0]
+        positions[cell] = -1
+        keys[0] = last_key
+        cells[0] = last_cell
+        positions[last_cell] = 0
+        self._sift_up(0)
+        return cell
+
+    def decrease_key(self, cell, key):
+        position = self.positions[cell]
+        self.keys[position] = key
+        self._sift_down(0, position)
+
+    def _sift_down(self, start, position):
+        """ Moves the item at _position_ towards the root, as heapq's
+            _siftdown does. """
+        keys, cells, positions = self.keys, self.cells, self.positions
+        key = keys[position]
+        cell = cells[position]
+        while position > start:
+            parent = (position - 1) >> 1
+            if key < keys[parent]:
+                keys[position] = keys[parent]
+                cells[position] = cells[parent]
+                positions[cells[position]] = position
+                position = parent
+                continue
+            break
+        keys[position] = key
+        cells[position] = cell
+        positions[cell] = position
+
+    def _sift_up(self, position):
+        """ Moves the item at _position_ down to a leaf along the smaller
+            children, then back up into place, as heapq's _siftup does. """
+        keys, cells, positions = self.keys, self.cells, self.positions
+        end = len(keys)
+        start = position
+        key = keys[position]
+        cell = cells[position]
+        child = 2*position + 1
+        while child < end:
+            right = child + 1
+            if right < end and not keys[child] < keys[right]:
+                child = right
+            keys[position] = keys[child]
+            cells[position] = cells[child]
+            positions[cells[position]] = position
+            position = child
+            child = 2*position + 1
+        keys[position] = key
+        cells[position] = cell
+        positions[cell] = position
+        self._sift_down(start, position)
+
+class PathFinder(object):
+    """ A* search over a Grid, configured for one AI.
+
+        Cells are tried from each cell in the order directions[d], where d
+        is the direction the cell was entered in; by default all four
+        directions, left, right, up and down. Open cells are ordered by
+        f = g + h, then by h, then by cell if _break_ties_by_cell_ is set,
+        else as heapq would leave them. A cell already open only gets a
+        better path if _improve_open_ is set. For showing the search,
+        on_visit(cell, is_closed) is called as each cell is opened and
+        closed. """
+    def __init__(self, grid, directions=None, break_ties_by_cell=False, improve_open=False):
+        self.grid = grid
+        self.directions = directions or [DIRECTIONS] * 4
+        self.break_ties_by_cell = break_ties_by_cell
+        self.improve_open = improve_open
+        self.on_visit = None
+        self.goal = None
+        self.nodes_expanded = 0
+        self.parents = self.entered = None
+
+    def find(self, start, goal, blocked, heuristic, direction=game.LEFT, start_h=None,
+            cost=None, retarget=None, stop_at=None, deadline=None):
+        """ Returns the path from _start_ to _goal_ as the list of cells
+            after _start_, or None if there is none.
+
+            _blocked_ tells which cells cannot be entered, heuristic(cell,
+            goal) estimates the cost from a cell to the goal, and cost(cell,
+            next_cell) is the cost of a step, 1 by default. _direction_ is
+            the direction _start_ was entered in, and _start_h_ overrides its
+            heuristic. When a cell is reached, retarget(cell) returning true
+            makes it the goal, and stop_at(cell) returning true ends the
+            search with the path to it. Cells stop being expanded after the
+            time _deadline_, from timeit.default_timer. The final goal is
+            left in self.goal, the number of cells expanded in
+            self.nodes_expanded, and each cell's parent and the direction it
+            was entered in in self.parents and self.entered. """
+        grid = self.grid
+        neighbors = grid.neighbors
+        directions = self.directions
+        break_ties = self.break_ties_by_cell
+        improve_open = self.improve_open
+        on_visit = self.on_visit
+
+        size = grid.size
+        g_scores = [0] * size
+        h_scores = [0] * size
+        parents = self.parents = [-1] * size
+        entered = self.entered = array('b', [0]) * size
+        closed = bytearray(size)
+        heap = IndexedHeap(size)
+        in_heap = heap.positions
+
+        h = heuristic(start, goal) if start_h is None else start_h
+        h_scores[start] = h
+        entered[start] = direction
+        heap.push(start, (h, h, start) if break_ties else (h, h))
+
+        self.nodes_expanded = 0
+        while heap.cells:
+            current = heap.pop()
+            self.nodes_expanded += 1
+            if current == goal:
+                self.goal = goal
+                return self.path_to(current)
+            closed[current] = 1
+            if on_visit is not None:
+                on_visit(current, True)
+            if deadline is not None and clock() > deadline:
+                continue
+
+            g_current = g_scores[current]
+            base = 4 * current
+            for d in directions[entered[current]]:
+                neighbor = neighbors[base + d]
+                if blocked[neighbor]:
+                    continue
+                if retarget is not None and retarget(neighbor):
+                    goal = neighbor
+                if not closed[neighbor]:
+                    g = g_current + (1 if cost is None else cost(current, neighbor))
+                    if in_heap[neighbor] < 0:
+                        h = heuristic(neighbor, goal)
+                        g_scores[neighbor] = g
+                        h_scores[neighbor] = h
+                        parents[neighbor] = current
+                        entered[neighbor] = d
+                        heap.push(neighbor, (g + h, h, neighbor) if break_ties else (g + h, h))
+                        if on_visit is not None:
+                            on_visit(neighbor, False)
+                    elif improve_open and g < g_scores[neighbor]:
+                        h = h_scores[neighbor]
+                        g_scores[neighbor] = g
+                        parents[neighbor] = current
+                        entered[neighbor] = d
+                        heap.decrease_key(neighbor, (g + h, h, neighbor) if break_ties else (g + h, h))
+                if stop_at is not None and neighbor != goal and stop_at(neighbor):
+                    self.goal = goal
+                    return self.path_to(neighbor)
+        self.goal = goal
+        return None
+
+    def path_to(self, cell):
+        """ Returns the cells of the path found to _cell_, not counting the
+            start. """
+        parents = self.parents
+        path = []
+        while parents[cell] >= 0:
+            path.append(cell)
+            cell = parents[cell]
+        path.reverse()
+        return path
@@ -1,10 +1,13 @@
-from multiprocessing import Process, Event
+from multiprocessing import Process, Event, Array, RawArray
 from ctypes import Structure, c_int
+from timeit import default_timer as clock
 
+import numpy
 from pygame.locals import *
 
 import game
-import game_objects
+import floodfill
+import pathfinding
 
 class GameObject(Structure):
     _fields_ = [('x', c_int), ('y', c_int)]
@@ -20,34 +23,97 @@ class MovableGameObject(Structure):
     def __repr__(self):
         return '(%d, %d) %d' % (self.x, self.y, self.direction,)
 
-class Serializer(object):
-    def serialize_board(self, board, _board):
-        for x, row in enumerate(board):
-            for y, obj in enumerate(row):
-                _board[x][y] = self.translate_board_obj(obj)
-        return _board
-
-    def translate_board_obj(self, obj):
-        if isinstance(obj, game_objects.Wall):
-            return 'W'
-        elif isinstance(obj, game_objects.IndestructableWall):
-            return 'I'
-        elif isinstance(obj, game_objects.Apple):
-            return 'A'
-        elif isinstance(obj, game_objects.SnakePart):
-            return 'S'
-        elif isinstance(obj, game_objects.Missile):
-            return 'M'
-        return ' '
+class AppleDistances(object):
+    """ Every cell's distance to the nearest apple, going round obstacles,
+        as a numpy array indexed by cell in shared memory. Obstacles are -2,
+        and cells no apple can be reached from -1.
+
+        The distances are worked out at most once a tick for all the AIs:
+        when first read in the game's process, or after every tick once an
+        AI reads them from a process of its own. """
+    def __init__(self):
+        self.grid = pathfinding.get_grid(game.BOARD_WIDTH, game.BOARD_HEIGHT)
+        self.shared = RawArray(c_int, self.grid.size)
+        self.values = numpy.frombuffer(self.shared, dtype=numpy.intc)
+        self.every_tick = False
+        self.update()
+
+    def get(self):
+        if not self.is_current:
+            self.update()
+        return self.values
+
+    def update(self):
+        grid = self.grid
+        apples = [grid.index(apple.x, apple.y) for apple in game.apples]
+        self.shared[:] = grid.distance_field(apples, game.board.codes)
+        self.is_current = True
+
+    def expire(self):
+        """ Marks the distances out of date, after a tick. """
+        self.is_current = False
+        if self.every_tick:
+            self.update()
+
+class SharedState(object):
+    """ Apple and player positions in shared memory, read by AI processes,
+        and the apple distances once they have been shared. """
+    def __init__(self):
+        self.apples = Array(GameObject,
+                list((apple.x, apple.y) for apple in game.apples))
+        self.players = Array(MovableGameObject,
+                list(((player.x, player.y), player.direction)
+                    for player in game.players))
+        self.apple_distances = None
+
+    def share_apple_distances(self):
+        if self.apple_distances is None:
+            self.apple_distances = AppleDistances()
+        return self.apple_distances
+
+    def update(self):
+        for i, v in enumerate([(apple.x, apple.y) for apple in game.apples]):
+            self.apples[i] = v
+
+        for i, v in enumerate([((player.x, player.y), player.direction, player.get_length()) for player in game.players]):
+            self.players[i] = v
+
+        if self.apple_distances is not None:
+            self.apple_distances.expire()
+
+def create_ai_processes(ai_classes, shared_state, input_queue):
+    """ Creates one AI per class, seated in player order. """
+    apple_distances = shared_state.share_apple_distances()
+    return [_class(player_index=i, board=game.board.codes,
+        players=shared_state.players, apples=shared_state.apples,
+        apple_distances=apple_distances,
+        player=game.players[i], args=(input_queue,))
+        for i, _class in enumerate(ai_classes)]
+
+def execute_ai_processes(ai_processes):
+    """ Runs the AIs that play in this process for the coming tick. An AI
+        with a ticks_per_execute of n runs on every nth tick, after those
+        that run more often. """
+    for proc in sorted(ai_processes, key=lambda proc: proc.ticks_per_execute):
+        if game.tick_count % proc.ticks_per_execute == proc.ticks_per_execute - 1:
+            start = clock()
+            proc.execute()
+            if game.tracer is not None:
+                game.tracer.span('execute', start, proc.player_index + 1)
+            if game.frame_timings is not None:
+                game.frame_timings.lap('AI %d %s' % (proc.player_index + 1, type(proc).__name__))
 
 class AIProcess(Process):
     """ Wrapper class for a python process. """
-    def __init__(self, player_index, board, players, apples, *args, **kwargs):
+    ticks_per_execute = 1
+
+    def __init__(self, player_index, board, players, apples, apple_distances=None, *args, **kwargs):
         super(AIProcess, self).__init__(*args, **kwargs)
         self.player_index = player_index
         self.input_queue = kwargs['args'][0]
         self.board = board
         self.apples = list(apples)
+        self.apple_distances = apple_distances  # An AppleDistances
         self._players = players
         self.stop = Event()
 
@@ -55,27 +121,50 @@ class AIProcess(Process):
     def player(self):
         return self._players[self.player_index]
 
+    def start(self):
+        if self.apple_distances is not None:
+            # The game's process can't tell when we read them
+            self.apple_distances.every_tick = True
+        super(AIProcess, self).start()
+
     def run(self):
+        game.tracer = None  # Only the game's process writes the trace
+        if self.apple_distances is not None:
+            self.apple_distances.is_current = True  # Kept current by the game's process
         while not self.stop.is_set():
             self.execute()
 
     def shutdown(self):
         self.stop.set()
 
-    def _press(self, key):
-        self.input_queue.put_nowait(key)
+    def _press(self, direction):
+        """ Submits a move, which the game applies with game.handle_input. """
+        self.input_queue.put_nowait((self.player_index, direction))
 
     def press_left(self):
-        self._press(game.player_controls[self.player_index][game.LEFT])
+        self._press(game.LEFT)
 
     def press_right(self):
-        self._press(game.player_controls[self.player_index][game.RIGHT])
+        self._press(game.RIGHT)
 
     def press_up(self):
-        self._press(game.player_controls[self.player_index][game.UP])
+        self._press(game.UP)
 
     def press_down(self):
-        self._press(game.player_controls[self.player_index][game.DOWN])
+        self._press(game.DOWN)
+
+    def reachable_area(self, x, y, limit=None):
+        """ Returns the number of cells that can be reached from (x, y), or
+            _limit_ if at least that many can be. """
+        return floodfill.reachable_area(self.board, x, y, limit)
+
+    def territories(self, heads=None):
+        """ Returns who reaches each cell first of snakes with their heads at
+            _heads_, by default every player's head, as floodfill.territories
+            does. """
+        if heads is None:
+            heads = [(player.x, player.y) for player in self._players]
+        return floodfill.territories(self.board, heads)
 
     def execute(self):
         """ Override this method to control your snake. Use a press_* function
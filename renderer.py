@@ -0,0 +1,232 @@
+""" Draws the game, redrawing only what changed since the last frame.
+
+    The board and scoreboard are kept drawn on a scene surface. The board
+    records which cells change, and each frame only those cells are redrawn
+    on the scene and copied to the screen, along with the few things that
+    move without changing the board: pulsing apples, blinking respawned
+    snakes and missiles flying over apples. Effects and text drawn over the
+    board are overlays; what they covered is restored from the scene on the
+    next frame. Only the changed areas are sent to the display.
+
+    Cells are copied from a tile atlas rather than drawn shape by shape, in
+    batches of Surface.blits. """
+import pygame
+
+import game
+
+class TileSheet(object):
+    """ Tiles of one size side by side on a surface, each drawn on first
+        use and kept under a key. """
+    def __init__(self, tile_width, tile_height, colorkey=None):
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.colorkey = colorkey
+        self.areas = {}
+        self.surface = self._make_surface(64)
+
+    def get(self, key, draw):
+        """ Returns the area of tile _key_, first calling draw(surface) to
+            draw it if it is new. """
+        area = self.areas.get(key)
+        if area is None:
+            index = len(self.areas)
+            if (index + 1) * self.tile_width > self.surface.get_width():
+                # Blit lists made earlier keep the old surface, which still
+                # holds their tiles
+                surface = self._make_surface(2 * index)
+                surface.blit(self.surface, (0, 0))
+                self.surface = surface
+            area = pygame.Rect(index * self.tile_width, 0, self.tile_width, self.tile_height)
+            draw(self.surface.subsurface(area))
+            self.areas[key] = area
+        return area
+
+    def _make_surface(self, num_tiles):
+        surface = pygame.Surface((num_tiles * self.tile_width, self.tile_height)).convert()
+        if self.colorkey is not None:
+            surface.fill(self.colorkey)
+            surface.set_colorkey(self.colorkey)
+        return surface
+
+class TileAtlas(object):
+    """ The tiles the board is made of, for one cell size: a solid cell for
+        each color of snake, missile, wall and the background, and a frame
+        for each color an apple pulses through. Apples are circles a little
+        larger than their cell, as in Apple.draw. """
+    def __init__(self, cell_width, cell_height):
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.cells = TileSheet(cell_width, cell_height)
+
+        radius = self.apple_radius = int(cell_width/2+1)
+        self.apples = TileSheet(2*radius + 3, 2*radius + 3, game.TRANSPARENT)
+        self.apple_offset = (cell_width//2 - radius - 1, cell_height//2 - radius - 1)
+        for green in range(0, 205, 4):  # See Apple.update
+            self.apple(pygame.Color(255, green, 0), 0, 0)
+
+    def cell(self, color, x, y):
+        """ Returns the blit of a cell of _color_ at _x_, _y_. """
+        area = self.cells.get(tuple(color), lambda surface: surface.fill(color))
+        return (self.cells.surface, (x*self.cell_width, y*self.cell_height), area)
+
+    def apple(self, color, x, y):
+        """ Returns the blit of an apple of _color_ at _x_, _y_. """
+        radius = self.apple_radius
+        area = self.apples.get(tuple(color), lambda surface: pygame.draw.circle(surface, color, (radius+1, radius+1), radius))
+        return (self.apples.surface, (x*self.cell_width + self.apple_offset[0], y*self.cell_height + self.apple_offset[1]), area)
+
+class Renderer(object):
+    full_redraw_cells = 250
+
+    def __init__(self, screen, background_color=pygame.Color(0, 0, 0)):
+        self.screen = screen
+        self.background_color = background_color
+        self.scene = pygame.Surface(screen.get_size()).convert()
+        self.scene.fill(background_color)
+        self.board = None  # The board drawn on the scene
+        self.atlas = None
+        self.apples = {}  # Cell => apples drawn over it, in drawing order
+        self.moving = {}  # Cell => snakes and missiles drawn there that are not on the board
+        self.overlays = []  # Screen areas drawn over the scene this frame
+        self.updates = []  # Screen areas to send to the display this frame
+
+    def invalidate(self):
+        """ Redraws everything on the next frame. """
+        self.board = None
+
+    def draw_board(self):
+        """ Brings the board up to date on the scene and the screen, and
+            restores the areas covered by last frame's overlays. Call once
+            per frame, before drawing any overlays. """
+        for rect in self.overlays:
+            self.screen.blit(self.scene, rect, rect)
+        self.updates.extend(self.overlays)
+        self.overlays = []
+
+        # A new level resets the board, which stops its change tracking.
+        # Each apple redraws five cells every frame as it pulses, so with
+        # many apples drawing everything once is cheaper.
+        num_objects = len(game.apples) + len(game.missiles) + \
+                sum(len(player.body) for player in game.players)
+        many_apples = self._cheaper_to_draw_all(5 * len(game.apples), num_objects)
+        if game.board is not self.board or game.board.dirty is None or \
+                self.moving is None or many_apples:
+            self._draw_all(not many_apples)
+            return
+
+        cells = set(self.moving)
+        cells.update(self.apples)
+        self._find_moving()
+        cells.update(self.moving)
+        cells.update(self.apples)
+        height = game.board.height
+        cells.update(divmod(i, height) for i in game.board.dirty)
+        game.board.dirty.clear()
+
+        if self._cheaper_to_draw_all(len(cells), num_objects):
+            self._draw_all()
+            return
+
+        # Draw the cells in layers, like a full redraw: apples, which spill
+        # into the cells next door, then what is on the board, then what is
+        # drawn over it
+        atlas = self.atlas
+        board = game.board
+        objects = board.objects
+        background = atlas.cell(self.background_color, 0, 0)
+        blits = []
+        drawn_over = []
+        for x, y in cells:
+            blits.append((background[0], (x*atlas.cell_width, y*atlas.cell_height), background[2]))
+            occupant = objects[x * height + y]
+            if occupant is not None and occupant.board_code != game.APPLE:
+                drawn_over.append(atlas.cell(occupant.color, x, y))
+            for obj in self.moving.get((x, y), ()):
+                if obj.board_code == game.MISSILE or obj.is_visible():
+                    drawn_over.append(atlas.cell(obj.color, x, y))
+        blits.extend(atlas.apple(apple.color, apple.x, apple.y) for apple in game.apples)
+        blits.extend(drawn_over)
+        self.scene.set_clip(self._board_rect())
+        self.scene.blits(blits, 0)
+        self.scene.set_clip(None)
+
+        rects = [pygame.Rect(blit[1], (atlas.cell_width, atlas.cell_height)) for blit in blits[:len(cells)]]
+        self.screen.blits([(self.scene, rect, rect) for rect in rects], 0)
+        self.updates.extend(rects)
+
+    def draw_panel(self, rect, draw):
+        """ Redraws part of the scene outside the board, such as the
+            scoreboard, by calling draw(surface). """
+        self.scene.set_clip(rect)
+        self.scene.fill(self.background_color, rect)
+        draw(self.scene)
+        self.scene.set_clip(None)
+        self.screen.blit(self.scene, rect, rect)
+        self.updates.append(pygame.Rect(rect))
+
+    def add_overlays(self, rects):
+        """ Records areas drawn directly on the screen this frame. """
+        self.overlays.extend(rects)
+
+    def present(self):
+        """ Sends the changed areas to the display. """
+        pygame.display.update(self.updates)
+        self.updates = []
+
+    def _cheaper_to_draw_all(self, num_cells, num_objects):
+        """ Redrawing a cell costs about twice as much as drawing an object
+            in a full redraw, which also fills and copies the whole screen at
+            about the cost of full_redraw_cells cells. Walls come in one blit. """
+        return num_cells > self.full_redraw_cells + num_objects / 2
+
+    def _find_moving(self):
+        """ Finds what is drawn this frame without a change to the board. """
+        self.apples = apples = {}
+        self.moving = moving = {}
+        board = game.board
+        for apple in game.apples:
+            # Apples pulse, and are drawn a little larger than their cell
+            for x, y in ((apple.x, apple.y), (apple.x-1, apple.y), (apple.x+1, apple.y), (apple.x, apple.y-1), (apple.x, apple.y+1)):
+                if 0 <= x < board.width and 0 <= y < board.height:
+                    apples.setdefault((x, y), []).append(apple)
+        for missile in game.missiles:
+            if not board.holds(missile.x, missile.y, missile):
+                moving.setdefault((missile.x, missile.y), []).append(missile)
+        for player in game.players:
+            if player.is_invincible:
+                for cell in player.body:
+                    moving.setdefault(cell, []).append(player)
+            elif not board.holds(player.body[0][0], player.body[0][1], player):
+                # A tail put back after a blocked missile launch is not on the board
+                moving.setdefault(player.body[0], []).append(player)
+
+    def _board_rect(self):
+        return pygame.Rect(0, 0, game.WINDOW_WIDTH, game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT)
+
+    def _draw_all(self, track_moving=True):
+        """ Redraws the whole board. The next frame is only drawn cell by
+            cell if _track_moving_ is set. """
+        self.board = game.board
+        self.board.dirty = set()
+        if track_moving:
+            self._find_moving()
+        else:
+            self.apples = self.moving = None
+        atlas = self.atlas
+        if atlas is None or (atlas.cell_width, atlas.cell_height) != (game.CELL_WIDTH, game.CELL_HEIGHT):
+            atlas = self.atlas = TileAtlas(game.CELL_WIDTH, game.CELL_HEIGHT)
+
+        board_rect = self._board_rect()
+        self.scene.fill(self.background_color, board_rect)
+        self.scene.set_clip(board_rect)
+        self.scene.blits([atlas.apple(apple.color, apple.x, apple.y) for apple in game.apples], 0)
+        self.scene.blit(game.wall_layer, (0, 0))
+        blits = [atlas.cell(missile.color, missile.x, missile.y) for missile in game.missiles]
+        for player in game.players:
+            if not player.is_dead and player.is_visible():
+                blits.extend(atlas.cell(player.color, x, y) for x, y in player.body)
+        self.scene.blits(blits, 0)
+        self.scene.set_clip(None)
+
+        self.screen.blit(self.scene, (0, 0))
+        self.updates = [self.screen.get_rect()]
@@ -0,0 +1,318 @@
+""" Compact replays of a game: the level, the random seed and every player
+    input, which is all that is needed to play a game back exactly.
+
+    File layout, little-endian:
+        'SNKR', version (1 byte), seed (4 bytes), ticks (4 bytes),
+        level file (2 byte length + name), number of players (1 byte),
+        player names (1 byte length + name each),
+        zlib-compressed input events.
+    Each input event is two varints: the ticks since the previous event, and
+    player_number << 3 | action, where an action is a direction or GROW. """
+import argparse
+from collections import deque
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zlib
+
+import pygame
+from pygame.locals import *
+
+import game
+import level
+import renderer
+import scheduler
+
+MAGIC = 'SNKR'
+VERSION = 2
+GROW = 4
+
+def write_varint(buf, value):
+    while value > 0x7f:
+        buf.append(value & 0x7f | 0x80)
+        value >>= 7
+    buf.append(value)
+
+def read_varint(buf, pos):
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+class Recorder(object):
+    """ Records the input of the game currently being played. Install it as
+        game.recorder right after game.init_level(). """
+    def __init__(self):
+        self.level_file = game.level.config_file
+        self.seed = game.rng_seed
+        self.events = bytearray()
+        self.last_tick = 0
+
+    def record_direction(self, player_number, direction):
+        self._record(player_number, direction)
+
+    def record_grow(self, player_number):
+        self._record(player_number, GROW)
+
+    def _record(self, player_number, action):
+        write_varint(self.events, game.tick_count - self.last_tick)
+        write_varint(self.events, player_number << 3 | action)
+        self.last_tick = game.tick_count
+
+    def save(self, path):
+        names = [player.name.encode('utf-8') for player in game.players]
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<4sBII', MAGIC, VERSION, self.seed, game.tick_count))
+            f.write(struct.pack('<H', len(self.level_file)) + self.level_file)
+            f.write(struct.pack('<B', len(names)))
+            for name in names:
+                f.write(struct.pack('<B', len(name)) + name)
+            f.write(zlib.compress(str(self.events), 9))
+
+class Replay(object):
+    """ A recorded game that can be stepped like a live one. """
+    def __init__(self, level_file, seed, ticks, names, events):
+        self.level_file = level_file
+        self.seed = seed
+        self.ticks = ticks
+        self.names = names
+        self.events = events  # List of (tick, player_number, action)
+        self.position = 0
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, seed, ticks = struct.unpack_from('<4sBII', data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d replay' % (path, VERSION))
+        pos = struct.calcsize('<4sBII')
+        length, = struct.unpack_from('<H', data, pos)
+        level_file = data[pos + 2:pos + 2 + length]
+        pos += 2 + length
+        names = []
+        for i in range(ord(data[pos])):
+            length = ord(data[pos + 1])
+            names.append(data[pos + 2:pos + 2 + length].decode('utf-8'))
+            pos += 1 + length
+        pos += 1
+
+        buf = bytearray(zlib.decompress(data[pos:]))
+        events = []
+        tick = pos = 0
+        while pos < len(buf):
+            delta, pos = read_varint(buf, pos)
+            code, pos = read_varint(buf, pos)
+            tick += delta
+            events.append((tick, code >> 3, code & 7))
+        return cls(level_file, seed, ticks, names, events)
+
+    def start(self):
+        """ Sets up the recorded level in the game module. """
+        game.recorder = None
+        game.level = level.Level(self.level_file)
+        game.num_players = len(self.names)
+        game.init_level(self.seed)
+        for player, name in zip(game.players, self.names):
+            player.name = name
+        self.players = dict((player.player_number, player) for player in game.players)
+        self.position = 0
+
+    def step(self):
+        """ Applies the input recorded for the current tick and updates the
+            game. """
+        while self.position < len(self.events) and self.events[self.position][0] == game.tick_count:
+            tick, player_number, action = self.events[self.position]
+            if action == GROW:
+                self.players[player_number].grow_on_next_move()
+            else:
+                self.players[player_number].set_direction(action)
+            self.position += 1
+        game.update()
+
+    def is_finished(self):
+        return game.tick_count >= self.ticks
+
+def start_recording():
+    game.recorder = Recorder()
+
+def save_recording(directory='replays'):
+    """ Stops recording and saves the replay. Returns the file name, or None
+        if nothing was being recorded. """
+    recorder, game.recorder = game.recorder, None
+    if recorder is None:
+        return None
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '%s-%d.replay' % (time.strftime('%Y%m%d-%H%M%S'), recorder.seed))
+    recorder.save(path)
+    return path
+
+def run_headless(replay):
+    game.headless = True
+    replay.start()
+    start_time = time.time()
+    while not replay.is_finished():
+        replay.step()
+    elapsed = time.time() - start_time
+
+    for player in game.players:
+        print '%s: %d kills, %d deaths' % (player.name, len(player.kills), len(player.deaths))
+    print '%d ticks in %.2fs: %d ticks/s' % (game.tick_count, elapsed,
+            game.tick_count / max(elapsed, 1e-9))
+
+def watch(replay, speed=1):
+    """ Plays a replay on screen, _speed_ times faster than it was played. """
+    import snake
+
+    pygame.init()
+    game.init_screen()
+    pygame.display.set_caption(game.NAME + ' - Replay')
+    clock = pygame.time.Clock()
+    screen_renderer = renderer.Renderer(game.screen)
+    scoreboard_rect = pygame.Rect(0, game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT, game.WINDOW_WIDTH, game.SCOREBOARD_HEIGHT)
+    shown_scoreboard = None
+
+    replay.start()
+    timestep = scheduler.FixedTimestep(game.ticks_per_second)
+    timestep.set_turbo(speed)
+    while True:
+        clock.tick(game.frames_per_second)
+
+        for event in pygame.event.get():
+            if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+                return
+            if event.type == VIDEOEXPOSE:
+                screen_renderer.invalidate()
+
+        game.effects.update()
+        game.particles.update()
+
+        for i in range(timestep.ticks_due()):
+            if replay.is_finished():
+                break
+            replay.step()
+
+        shown_scoreboard = draw_frame(screen_renderer, scoreboard_rect, shown_scoreboard, "Press [ESC] to quit.")
+        screen_renderer.present()
+
+def draw_frame(screen_renderer, scoreboard_rect, shown_scoreboard, win_text):
+    """ Draws the game on the screen as it is watched. Returns the
+        scoreboard shown, to be passed in for the next frame. """
+    import snake
+
+    screen_renderer.draw_board()
+    screen_renderer.add_overlays(game.effects.draw())
+    screen_renderer.add_overlays(game.particles.draw(game.screen))
+    screen_renderer.add_overlays(game.log_screen.draw())
+
+    runtime = game.tick_count / game.ticks_per_second
+    scoreboard = ([len(player.kills) for player in game.players], runtime)
+    if scoreboard != shown_scoreboard:
+        shown_scoreboard = scoreboard
+        screen_renderer.draw_panel(scoreboard_rect, lambda surface: snake.draw_scoreboard(runtime, surface=surface))
+
+    winners = game.get_winners()
+    if winners:
+        snake.draw_win_screen(winners, win_text)
+        screen_renderer.add_overlays([game.screen.get_rect()])
+    return shown_scoreboard
+
+def save_frame(path, size, data):
+    """ Saves a frame of raw RGB bytes as an image, in the format named by
+        the extension of _path_. Run by the export workers. """
+    pygame.image.save(pygame.image.fromstring(data, size, 'RGB'), path)
+
+def export_frames(replay, output, workers=None):
+    """ Plays a replay off screen as fast as possible, drawing a frame for
+        every tick. If _output_ is '-' or a .rgb or .raw file, which may be a
+        named pipe, the frames are written to it as raw RGB bytes, ready for
+        a video encoder. Otherwise they are saved as numbered images at the
+        path pattern _output_, such as frames/%06d.png, by a pool of
+        _workers_ processes. """
+    stream = pool = None
+    if output == '-':
+        stream = sys.stdout
+    elif os.path.splitext(output)[1] in ('.rgb', '.raw'):
+        stream = open(output, 'wb')
+    else:
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        workers = workers or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(workers)  # Started before pygame, so the workers don't inherit a display
+        pending = deque()
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    game.init_screen()
+    screen_renderer = renderer.Renderer(game.screen)
+    scoreboard_rect = pygame.Rect(0, game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT, game.WINDOW_WIDTH, game.SCOREBOARD_HEIGHT)
+    shown_scoreboard = None
+    size = game.screen.get_size()
+
+    replay.start()
+    start_time = time.time()
+    num_frames = 0
+    while True:
+        shown_scoreboard = draw_frame(screen_renderer, scoreboard_rect, shown_scoreboard, "")
+        screen_renderer.present()
+        data = pygame.image.tostring(game.screen, 'RGB')
+        if stream is not None:
+            stream.write(data)
+        else:
+            # Keep a few frames queued per worker, without holding the whole match
+            pending.append(pool.apply_async(save_frame, (output % num_frames, size, data)))
+            if len(pending) > 2 * workers:
+                pending.popleft().get()
+        num_frames += 1
+
+        if replay.is_finished():
+            break
+        replay.step()
+        game.effects.update()
+        game.particles.update()
+
+    if stream is not None and stream is not sys.stdout:
+        stream.close()
+    if pool is not None:
+        for result in pending:
+            result.get()
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start_time
+    print >>sys.stderr, '%d frames of %dx%d in %.2fs: %.1f frames/s, %.1fx real time' % (num_frames,
+            size[0], size[1], elapsed, num_frames / max(elapsed, 1e-9),
+            num_frames / float(game.ticks_per_second) / max(elapsed, 1e-9))
+
+def main():
+    parser = argparse.ArgumentParser(description='Play back a recorded game.')
+    parser.add_argument('replay', help='replay file')
+    parser.add_argument('--speed', type=int, default=1,
+            help='playback speed multiplier')
+    parser.add_argument('--headless', action='store_true',
+            help='play without a display as fast as possible')
+    parser.add_argument('--export', metavar='OUTPUT',
+            help='render a frame per tick off screen, as images at a path pattern '
+            'such as frames/%%06d.png, or as raw RGB bytes to a .rgb file or pipe, '
+            'or to stdout if -')
+    parser.add_argument('--workers', type=int,
+            help='processes saving exported images (default: one per CPU)')
+    args = parser.parse_args()
+
+    replay = Replay.load(args.replay)
+    if args.export:
+        export_frames(replay, args.export, args.workers)
+    elif args.headless:
+        run_headless(replay)
+    else:
+        watch(replay, args.speed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+""" Fixed timestep scheduling. The simulation advances in ticks of a fixed
+    length of game time, however fast or slow frames are being drawn. """
+import time
+
+class FixedTimestep(object):
+    """ Tells the main loop how many ticks to run before drawing each frame.
+
+        When drawing falls behind, several ticks are run before the next
+        frame, so the game keeps its speed at a lower frame rate. If even
+        that cannot keep up, at most max_ticks_per_frame ticks are run per
+        frame and the game slows down instead of falling further behind.
+        The turbo multiplier speeds up game time for fast-forwarding. """
+    def __init__(self, ticks_per_second, max_ticks_per_frame=5, clock=time.time):
+        self.tick_length = 1.0 / ticks_per_second
+        self.max_ticks_per_frame = max_ticks_per_frame
+        self.clock = clock
+        self.turbo = 1
+        self.dropped_ticks = 0  # Ticks given up because the game could not keep up
+        self.reset()
+
+    def reset(self):
+        """ Starts counting from now, forgetting any time owed. Call this
+            when a game starts or resumes. """
+        self.last_time = self.clock()
+        self.accumulator = 0.0
+
+    def ticks_due(self):
+        """ Returns how many ticks to run before drawing the next frame. """
+        now = self.clock()
+        self.accumulator += (now - self.last_time) * self.turbo
+        self.last_time = now
+
+        ticks = int(self.accumulator / self.tick_length)
+        self.accumulator -= ticks * self.tick_length
+        limit = self.max_ticks_per_frame * self.turbo
+        if ticks > limit:
+            self.dropped_ticks += ticks - limit
+            ticks = limit
+        return ticks
+
+    def set_turbo(self, turbo):
+        self.turbo = max(1, turbo)
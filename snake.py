@@ -1,25 +1,31 @@
 from collections import deque
 import multiprocessing
 import Queue
-import time
 
 import pygame
 from pygame.locals import *
 
+import fonts
 import game
-import game_objects
 import level
 
 import process
+import renderer
+import replay
+import scheduler
+import tracing
 from ai_vincent import VincentAI
 from ai_jason import JasonAI
 from ai_jameel import JameelAI
 ai_classes = [VincentAI, JasonAI, JameelAI]
+demo_ai_classes = [VincentAI, JasonAI, JameelAI, JasonAI]  # Seated in turn in AI demos
+
+WHITE = pygame.Color(255, 255, 255)
 
 class Menu():
     def __init__(self, options, spacing=50):
         self.options = options
-        self.font = pygame.font.SysFont("verdana", 30)
+        self.font = fonts.get("verdana", 30)
         self.font_color = pygame.Color(255, 255, 255)
         self.selector_color = pygame.Color(255, 255, 255)
         self.selector_padding = 20
@@ -38,9 +44,7 @@ class Menu():
 
         title_text = game.NAME
         title_color = pygame.Color(0, 255, 0)
-        title_font = pygame.font.SysFont("impact", 70)
         title_top = 100
-        subtitle_font = pygame.font.SysFont("georgia", 15)
         subtitle_text = "By Vincent and Jason"
         subtitle_top = 190
 
@@ -71,18 +75,18 @@ class Menu():
             game.screen.blit(background, (0, 0))
 
             # Draw title
-            title = title_font.render(title_text, 1, title_color)
+            title = fonts.render(title_text, "impact", 70, title_color)
             title_pos = title.get_rect(centerx = game.WINDOW_WIDTH/2, y = title_top)
             game.screen.blit(title, title_pos)
 
             # Draw subtitle
-            subtitle = subtitle_font.render(subtitle_text, 1, title_color)
+            subtitle = fonts.render(subtitle_text, "georgia", 15, title_color)
             subtitle_pos = subtitle.get_rect(centerx = game.WINDOW_WIDTH/2, y = subtitle_top)
             game.screen.blit(subtitle, subtitle_pos)
 
             # Draw menu options
             for i, option in enumerate(self.options):
-                text = self.font.render(option, 1, self.font_color)
+                text = fonts.render(option, "verdana", 30, self.font_color)
                 text_position = text.get_rect(centerx = game.WINDOW_WIDTH/2, y = menu_top + menu_item_height * i)
                 game.screen.blit(text, text_position)
 
@@ -94,13 +98,111 @@ class Menu():
             # Display!
             pygame.display.flip()
 
+def draw_scoreboard(runtime, turbo=1, surface=None):
+    """ Draws each player's kills, the match clock, given in seconds, and the
+        turbo multiplier when fast-forwarding. """
+    if surface is None:
+        surface = game.screen
+    score_icon_size = 30
+    score_width = 55
+    score_margin = max(0, min(120, (game.WINDOW_WIDTH - 200) / game.num_players - score_width))
+    all_score_widths = game.num_players * score_width + (game.num_players-1) * score_margin
+    score_x = (game.WINDOW_WIDTH - all_score_widths)/2
+    score_y = game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT + (game.SCOREBOARD_HEIGHT-score_icon_size)/2
+    for i, player in enumerate(game.players):
+        icon = pygame.Rect(score_x + i*(score_width+score_margin), score_y, score_icon_size, score_icon_size)
+        text = str(len(player.kills))
+
+        score = fonts.render(text, 'impact', 30, WHITE)
+        score_pos = score.get_rect(left = icon.right + 10, centery = icon.centery)
+
+        surface.blit(score, score_pos)
+        pygame.draw.rect(surface, player.color, icon)
+
+    runtime = int(runtime)
+    runtime_min = runtime // 60
+    runtime_sec = runtime % 60
+    if runtime_min < 10:
+        runtime_min = "0" + str(runtime_min)
+    if runtime_sec < 10:
+        runtime_sec = "0" + str(runtime_sec)
+    runtime_text = "%s : %s" % (runtime_min, runtime_sec)
+
+    time_text = fonts.render(runtime_text, 'impact', 24, WHITE)
+    time_pos = time_text.get_rect(x = game.WINDOW_WIDTH - 95, y = game.WINDOW_HEIGHT - 54)
+    surface.blit(time_text, time_pos)
+
+    if turbo > 1:
+        turbo_text = fonts.render('x%d' % turbo, 'impact', 24, WHITE)
+        surface.blit(turbo_text, turbo_text.get_rect(x = 30, y = game.WINDOW_HEIGHT - 54))
+
+def draw_win_screen(winners, subtitle="Press [ENTER] to play again, or [ESC] to return to the main menu."):
+    """ Draws the winner and every player's kill and death summary. """
+    # Check for ties
+    if len(winners) > 1:
+        title = fonts.render("Draw!", "impact", 100, WHITE)
+    else:
+        title = fonts.render(winners[0].name + " wins!", "impact", 100, WHITE)
+
+    # Draw title
+    title_pos = title.get_rect(centerx = game.WINDOW_WIDTH/2, centery = 200)
+    game.screen.blit(title, title_pos)
+
+    # Draw subtitle
+    subtext = fonts.render(subtitle, "verdana", 15, WHITE)
+    subtext_pos = subtext.get_rect(centerx = game.WINDOW_WIDTH/2, y = title_pos.bottom + 10)
+    game.screen.blit(subtext, subtext_pos)
+
+    # Draw summary
+    header_width = min(200, game.WINDOW_WIDTH / game.num_players)
+    header_height = 30
+    header_margin = 0
+    header_x = (game.WINDOW_WIDTH - header_width * game.num_players) / 2
+    header_y = subtext_pos.bottom + 50
+    cell_margin = 20
+
+    for i, player in enumerate(game.players):
+        # Draw header box
+        header = pygame.Rect(header_x + (header_width+header_margin)*i, header_y, header_width, header_height)
+        pygame.draw.rect(game.screen, player.color, header)
+
+        # Draw header text
+        text = fonts.render(player.name, "arial", 16, WHITE, bold=True)
+        text_pos = text.get_rect(centerx = header.centerx, centery = header.centery)
+        game.screen.blit(text, text_pos)
+
+        # Draw death summary
+        s = "Total deaths: " + str(len(player.deaths))
+        death_summary_font = fonts.render(s, "arial", 14, WHITE, bold=True)
+        death_summary_pos = death_summary_font.get_rect(centerx = header.centerx, centery = header.bottom + cell_margin)
+        game.screen.blit(death_summary_font, death_summary_pos)
+
+        causes = game.get_death_causes(player)
+        strings = [str(causes[cause]) + " by " + cause for cause in game.DEATH_CAUSES]
+
+        for i, s in enumerate(strings):
+            text = fonts.render(s, "arial", 13, WHITE)
+            text_pos = text.get_rect(centerx = header.centerx, centery = death_summary_pos.bottom + (i+1)*cell_margin)
+            game.screen.blit(text, text_pos)
+
+        # Draw kill summary
+        s = "Total kills: " + str(len(player.kills))
+        kill_summary_font = fonts.render(s, "arial", 14, WHITE, bold=True)
+        kill_summary_pos = kill_summary_font.get_rect(centerx = header.centerx, centery = header.bottom + cell_margin + 130)
+        game.screen.blit(kill_summary_font, kill_summary_pos)
+
+        for i, opponent in enumerate(player.kills):
+            text = fonts.render(opponent.name, "arial", 13, opponent.color)
+            text_pos = text.get_rect(centerx = header.centerx, centery = kill_summary_pos.bottom + (i+1)*cell_margin)
+            game.screen.blit(text, text_pos)
+
 def main_loop():
     pygame.init()
+    game.init_screen()
     pygame.display.set_caption(game.NAME)
     clock = pygame.time.Clock()
-
-    background = pygame.Surface(game.screen.get_size()).convert()
-    background.fill(pygame.Color(0, 0, 0))
+    screen_renderer = renderer.Renderer(game.screen)
+    scoreboard_rect = pygame.Rect(0, game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT, game.WINDOW_WIDTH, game.SCOREBOARD_HEIGHT)
 
     input_queue = multiprocessing.Queue()
 
@@ -123,211 +225,139 @@ def main_loop():
 
             # If single player, add an AI player
             if game.num_players == 1:
-                game.num_players = 4
+                game.num_players = game.level.num_spawns
                 game.init_level()
 
-                ai_engines = []
+                ai_engines = [demo_ai_classes[i % len(demo_ai_classes)]
+                        for i in range(len(game.players))]
                 ai_processes = []
-                ai_engines.append(ai_classes[0])
-                ai_engines.append(ai_classes[1])
-                ai_engines.append(ai_classes[2])
-                ai_engines.append(ai_classes[1])
-                shared_apples = multiprocessing.Array(process.GameObject,
-                        list((apple.x, apple.y) for apple in game.apples))
-                shared_players = multiprocessing.Array(process.MovableGameObject,
-                        list(((player.x, player.y), player.direction)
-                            for player in game.players))
-                ai_processes = [_class(player_index=i, board=game.shared_board, players=shared_players, apples=shared_apples, player=game.players[i], args=(input_queue,)) for i, _class in enumerate(ai_engines)]
+                shared_state = process.SharedState()
+                ai_processes = process.create_ai_processes(ai_engines, shared_state, input_queue)
                 # Load threaded AI
                 if game.use_multiprocessing:
                     map(lambda proc: proc.start(), ai_processes)
-                game.players[1].name = 'The Spirit of AI'
-                game.players[1].name = 'Bebe Bot'
-                game.players[2].name = 'The Will of AI'
-                game.players[3].name = 'Bot Choy'
+                for player, name in zip(game.players[1:], ['Bebe Bot', 'The Will of AI', 'Bot Choy']):
+                    player.name = name
             else:
                 game.init_level()
+                shared_state = process.SharedState()
+                ai_processes = []
+
+            if game.record_replays:
+                replay.start_recording()
+            if game.trace:
+                tracing.start_tracing()
+                for proc in ai_processes:
+                    game.tracer.name_thread(proc.player_index + 1, 'AI %d %s' % (proc.player_index + 1, type(proc).__name__))
 
         # Start game loop
         return_to_menu = False
         game_status = None
-        ai_frame_count = 1
-        start_time = time.time()
+        timestep = scheduler.FixedTimestep(game.ticks_per_second)
+        shown_scoreboard = None
+        timings = game.frame_timings
 
         while not return_to_menu:
             clock.tick(game.frames_per_second)
-
-            while True:
-                # Process key presses from AI threads.
-                # Pulls values from input queue, creates pygame Events, and
-                # submits to event queue.
-                try:
-                    pygame.event.post(pygame.event.Event(KEYDOWN, {'key':
-                        input_queue.get_nowait(),}))
-                except Queue.Empty, qe:
-                    break
-
-            # Process non multiprocessing AI moves
-            if not game.use_multiprocessing:
-                # map(lambda proc: proc.execute(), ai_processes)
-                for proc in ai_processes:
-                    if not isinstance(proc, JasonAI):
-                        proc.execute()
-
-                if ai_frame_count < 3:
-                    ai_frame_count += 1
-                else:
-                    for proc in ai_processes:
-                        if isinstance(proc, JasonAI):
-                            proc.execute()
-                    ai_frame_count = 1
+            if timings is not None:
+                timings.skip()
 
             # Get input
             for event in pygame.event.get():
                 if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
                     return_to_menu = True
+                    replay.save_recording()
+                    tracing.stop_tracing()
                     # Shutdown all AI processes
                     if game.use_multiprocessing:
                         map(lambda proc: proc.shutdown(), ai_processes)
                     break
 
-                if event.type == KEYDOWN:
+                if event.type == VIDEOEXPOSE:
+                    screen_renderer.invalidate()
+                elif event.type == KEYDOWN:
                     if event.key == K_SPACE:
-                        game.players[0].grow = True
+                        game.players[0].grow_on_next_move()
                     elif event.key == K_RETURN and game_status == "win":
+                        replay.save_recording()
                         game.init_level()
+                        if game.record_replays:
+                            replay.start_recording()
                         game_status = None
                         continue
-                    elif event.key in game.player_controls[0]:
-                        game.players[0].set_direction(game.player_controls[0].index(event.key))
-                    elif event.key in game.player_controls[1] and game.num_players > 1:
-                        game.players[1].set_direction(game.player_controls[1].index(event.key))
-                    elif event.key in game.player_controls[2] and game.num_players > 2:
-                        game.players[2].set_direction(game.player_controls[2].index(event.key))
-                    elif event.key in game.player_controls[3] and game.num_players > 3:
-                        game.players[3].set_direction(game.player_controls[3].index(event.key))
+                    elif event.key == K_TAB:
+                        if timestep.turbo == 1:
+                            timestep.set_turbo(game.turbo_multiplier)
+                        else:
+                            timestep.set_turbo(1)
+                    else:
+                        game.handle_key(event.key)
+
+            if timings is not None:
+                timings.lap('events')
+
+            # Run the game ticks due since the last frame
+            for i in range(timestep.ticks_due()):
+                # Process moves submitted by AI processes
+                while True:
+                    try:
+                        game.handle_input(*input_queue.get_nowait())
+                    except Queue.Empty, qe:
+                        break
+                if timings is not None:
+                    timings.lap('input')
+
+                # Process non multiprocessing AI moves
+                if not game.use_multiprocessing:
+                    process.execute_ai_processes(ai_processes)
+
+                # Update game
+                game.update()
+
+                # Update shared board
+                shared_state.update()
+                if timings is not None:
+                    timings.lap('shared state')
 
             # Update effects
-            for effect in game.effects:
-                effect.update()
-
-            # Update game
-            game.update()
-
-            # Update shared board
-            for i, v in enumerate([(apple.x, apple.y) for apple in game.apples]):
-                shared_apples[i] = v
-
-            for i, v in enumerate([((player.x, player.y), player.direction, player.get_length()) for player in game.players]):
-                shared_players[i] = v
-
-            # Draw the screen
-            game.screen.blit(background, (0, 0))
-            game.draw()
-            for effect in game.effects:
-                effect.draw()
+            game.effects.update()
+            game.particles.update()
+            if timings is not None:
+                timings.lap('effects')
+
+            # Draw what changed since the last frame
+            render_start = tracing.clock()
+            screen_renderer.draw_board()
+            screen_renderer.add_overlays(game.effects.draw())
+            screen_renderer.add_overlays(game.particles.draw(game.screen))
+            screen_renderer.add_overlays(game.log_screen.draw())
 
             # Draw scoreboard
-            score_icon_size = 30
-            score_width = 55
-            score_margin = 120
-            all_score_widths = game.num_players * score_width + (game.num_players-1) * score_margin
-            score_x = (game.WINDOW_WIDTH - all_score_widths)/2
-            score_y = game.WINDOW_HEIGHT - game.SCOREBOARD_HEIGHT + (game.SCOREBOARD_HEIGHT-score_icon_size)/2
-            for i, player in enumerate(game.players):
-                icon = pygame.Rect(score_x + i*(score_width+score_margin), score_y, score_icon_size, score_icon_size)
-                text = str(len(player.kills))
-
-                score = pygame.font.SysFont('impact', 30).render(text, 1, pygame.Color("white"))
-                score_pos = score.get_rect(left = icon.right + 10, centery = icon.centery)
-
-                game.screen.blit(score, score_pos)
-                pygame.draw.rect(game.screen, player.color, icon)
-
-            runtime = int(time.time() - start_time)
-            runtime_min = runtime // 60
-            runtime_sec = runtime % 60
-            if runtime_min < 10:
-                runtime_min = "0" + str(runtime_min)
-            if runtime_sec < 10:
-                runtime_sec = "0" + str(runtime_sec)
-            runtime_text = "%s : %s" % (runtime_min, runtime_sec)
-
-            time_text = pygame.font.SysFont('impact', 24).render(runtime_text, 1, pygame.Color("white"))
-            time_pos = time_text.get_rect(x = game.WINDOW_WIDTH - 95, y = game.WINDOW_HEIGHT - 54)
-            game.screen.blit(time_text, time_pos)
+            runtime = game.tick_count / game.ticks_per_second
+            scoreboard = ([len(player.kills) for player in game.players], runtime, timestep.turbo)
+            if scoreboard != shown_scoreboard:
+                shown_scoreboard = scoreboard
+                screen_renderer.draw_panel(scoreboard_rect, lambda surface: draw_scoreboard(runtime, timestep.turbo, surface))
 
             # Check for the win condition
-            winners = filter(lambda p: len(p.kills) >= game.level.kills_to_win, game.players)
+            winners = game.get_winners()
             if winners:
                 game_status = 'win'
+                draw_win_screen(winners)
+                screen_renderer.add_overlays([game.screen.get_rect()])
 
-                # Check for ties
-                least_deaths = min(len(w.deaths) for w in winners)
-                winners = filter(lambda w: len(w.deaths) == least_deaths, winners)
-                if len(winners) > 1:
-                    title = pygame.font.SysFont("impact", 100).render("Draw!", 1, pygame.Color("white"))
-                else:
-                    title = pygame.font.SysFont("impact", 100).render(winners[0].name + " wins!", 1, pygame.Color("white"))
-
-                # Draw title
-                title_pos = title.get_rect(centerx = game.WINDOW_WIDTH/2, centery = 200)
-                game.screen.blit(title, title_pos)
-
-                # Draw subtitle
-                subtext = pygame.font.SysFont("verdana", 15).render("Press [ENTER] to play again, or [ESC] to return to the main menu.", 1, pygame.Color("white"))
-                subtext_pos = subtext.get_rect(centerx = game.WINDOW_WIDTH/2, y = title_pos.bottom + 10)
-                game.screen.blit(subtext, subtext_pos)
-
-                # Draw summary
-                header_width = 200
-                header_height = 30
-                header_margin = 0
-                header_x = (game.WINDOW_WIDTH - header_width * game.num_players) / 2
-                header_y = subtext_pos.bottom + 50
-                cell_margin = 20
-
-                for i, player in enumerate(game.players):
-                    # Draw header box
-                    header = pygame.Rect(header_x + (header_width+header_margin)*i, header_y, header_width, header_height)
-                    pygame.draw.rect(game.screen, player.color, header)
-
-                    # Draw header text
-                    text = pygame.font.SysFont("arial", 16, bold=True).render(player.name, 1, pygame.Color("white"))
-                    text_pos = text.get_rect(centerx = header.centerx, centery = header.centery)
-                    game.screen.blit(text, text_pos)
-
-                    # Draw death summary
-                    s = "Total deaths: " + str(len(player.deaths))
-                    death_summary_font = pygame.font.SysFont("arial", 14, bold=True).render(s, 1, pygame.Color("white"))
-                    death_summary_pos = death_summary_font.get_rect(centerx = header.centerx, centery = header.bottom + cell_margin)
-                    game.screen.blit(death_summary_font, death_summary_pos)
-
-                    strings = []
-                    strings.append(str(len(filter(lambda c: isinstance(c, game_objects.SnakePart) and c.player is not player, player.deaths))) + " by collision")
-                    strings.append(str(len(filter(lambda c: isinstance(c, game_objects.Missile) and c.player is not player, player.deaths))) + " by missile")
-                    strings.append(str(len(filter(lambda c: isinstance(c, game_objects.Wall), player.deaths))) + " by wall")
-                    strings.append(str(len(filter(lambda c: (isinstance(c, game_objects.Missile) and c.player is player) or (isinstance(c, game_objects.SnakePart) and c.player is player), player.deaths))) + " by suicide")
-
-                    for i, s in enumerate(strings):
-                        text = pygame.font.SysFont("arial", 13).render(s, 1, pygame.Color("white"))
-                        text_pos = text.get_rect(centerx = header.centerx, centery = death_summary_pos.bottom + (i+1)*cell_margin)
-                        game.screen.blit(text, text_pos)
-
-                    # Draw kill summary
-                    s = "Total kills: " + str(len(player.kills))
-                    kill_summary_font = pygame.font.SysFont("arial", 14, bold=True).render(s, 1, pygame.Color("white"))
-                    kill_summary_pos = kill_summary_font.get_rect(centerx = header.centerx, centery = header.bottom + cell_margin + 130)
-                    game.screen.blit(kill_summary_font, kill_summary_pos)
-
-                    for i, opponent in enumerate(player.kills):
-                        text = pygame.font.SysFont("arial", 13).render(opponent.name, 1, opponent.color)
-                        text_pos = text.get_rect(centerx = header.centerx, centery = kill_summary_pos.bottom + (i+1)*cell_margin)
-                        game.screen.blit(text, text_pos)
-
+            if timings is not None:
+                timings.lap('draw')
+                screen_renderer.add_overlays(timings.draw(game.screen))
+                timings.skip()
 
             # Display!
-            pygame.display.flip()
+            screen_renderer.present()
+            if game.tracer is not None:
+                game.tracer.span('render', render_start)
+            if timings is not None:
+                timings.lap('display')
+                timings.end_frame()
 
 if __name__ == '__main__':
     main_loop()
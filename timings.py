@@ -0,0 +1,90 @@
+""" Time spent per frame in each phase of the main loop, for finding what
+    makes the game stutter.
+
+    Phases are timed with laps: each lap is charged the time since the one
+    before it, and a phase run several times in a frame, such as one per
+    tick, adds up. At the end of a frame the total of every phase goes into
+    a ring buffer holding the last frames, from which percentiles are
+    drawn. Switched on with frame_timings in snake.ini, which makes
+    game.frame_timings a FrameTimings; it is None otherwise. """
+from timeit import default_timer as clock
+
+import numpy
+
+import fonts
+
+class RingBuffer(object):
+    """ The last _size_ values added. """
+    def __init__(self, size):
+        self.values = numpy.zeros(size)
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def percentiles(self, percents):
+        return numpy.percentile(self.values[:self.count], percents)
+
+class FrameTimings(object):
+    percents = (50, 95, 99)
+
+    def __init__(self, num_frames=300, refresh_frames=15):
+        self.num_frames = num_frames
+        self.refresh_frames = refresh_frames  # Frames between redrawing the overlay's numbers
+        self.phases = []  # Phase names in the order first timed
+        self.buffers = {}
+        self.frame = {}  # Phase => seconds so far this frame
+        self.total = RingBuffer(num_frames)  # Seconds per frame, in all phases
+        self.num_frames_ended = 0
+        self.lines = []
+        self.last_time = clock()
+
+    def lap(self, phase):
+        """ Charges the time since the last lap to _phase_. """
+        now = clock()
+        seconds = self.frame.get(phase)
+        if seconds is None:
+            seconds = 0.0
+            if phase not in self.buffers:
+                self.phases.append(phase)
+                self.buffers[phase] = RingBuffer(self.num_frames)
+        self.frame[phase] = seconds + now - self.last_time
+        self.last_time = now
+
+    def skip(self):
+        """ Starts the next lap from now, leaving the time uncharged. """
+        self.last_time = clock()
+
+    def end_frame(self):
+        frame = self.frame
+        total = 0.0
+        for phase in self.phases:
+            seconds = frame.get(phase, 0.0)
+            self.buffers[phase].add(seconds)
+            total += seconds
+        self.frame = {}
+        self.total.add(total)
+        self.num_frames_ended += 1
+
+    def percentiles(self, phase=None):
+        """ Returns the p50, p95 and p99 of _phase_, or of whole frames, in
+            milliseconds. """
+        buffer = self.total if phase is None else self.buffers[phase]
+        return [seconds * 1000 for seconds in buffer.percentiles(self.percents)]
+
+    def draw(self, surface, x=10, y=10):
+        """ Draws a table of the percentiles of each phase, and returns the
+            areas drawn. """
+        if not self.num_frames_ended:
+            return []
+        if self.num_frames_ended % self.refresh_frames == 1 or not self.lines:
+            self.lines = ['%-16s %7s %7s %7s' % (('phase (ms)',) + tuple('p%d' % p for p in self.percents))]
+            for phase in self.phases:
+                self.lines.append('%-16s %7.2f %7.2f %7.2f' % ((phase[:16],) + tuple(self.percentiles(phase))))
+            self.lines.append('%-16s %7.2f %7.2f %7.2f' % (('frame',) + tuple(self.percentiles())))
+        rects = []
+        for i, line in enumerate(self.lines):
+            text = fonts.render(line, "couriernew", 12, (255, 255, 0))
+            rects.append(surface.blit(text, (x, y + i*14)))
+        return rects
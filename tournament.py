@@ -0,0 +1,131 @@
+""" Round-robin AI tournament. Every level is played with every seating of the
+    AIs, and the headless matches are spread over all cores. """
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+import game
+import headless
+import level
+
+def get_seatings(names, seats):
+    """ Returns every assignment of AIs to seats in which as many different
+        AIs as possible take part. """
+    needed = min(len(names), seats)
+    return [seating for seating in itertools.product(names, repeat=seats)
+            if len(set(seating)) == needed]
+
+def play_match(args):
+    """ Plays one match in a worker process and returns its statistics. """
+    level_file, seating, max_ticks, seed = args
+    match = headless.Match(level.Level(level_file),
+            [headless.ai_classes[name] for name in seating], max_ticks=max_ticks,
+            seed=seed)
+    winners = match.run()
+    return {
+        'level': level_file,
+        'seating': seating,
+        'seed': seed,
+        'ticks': match.ticks,
+        'winner': game.players.index(winners[0]) if len(winners) == 1 else None,
+        'kills': [len(player.kills) for player in game.players],
+        'deaths': [game.get_death_causes(player) for player in game.players],
+        'total_deaths': [len(player.deaths) for player in game.players],
+    }
+
+def silence_worker():
+    """ The AIs report their deaths on stdout, which would bury the results. """
+    sys.stdout = open(os.devnull, 'w')
+
+def print_table(title, headers, rows):
+    widths = [max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))]
+    print
+    print title
+    print '  '.join(str(h).ljust(w) for h, w in zip(headers, widths))
+    print '  '.join('-' * w for w in widths)
+    for row in rows:
+        print '  '.join(str(v).ljust(w) for v, w in zip(row, widths))
+
+def summarize(results, names):
+    stats = dict((name, {'matches': 0, 'wins': 0, 'draws': 0, 'kills': 0,
+        'deaths': 0, 'causes': dict((c, 0) for c in game.DEATH_CAUSES)})
+        for name in names)
+    level_wins = {}
+
+    for result in results:
+        lvl = os.path.basename(result['level'])
+        level_wins.setdefault(lvl, dict((name, 0) for name in names + ['draw']))
+        if result['winner'] is None:
+            level_wins[lvl]['draw'] += 1
+        else:
+            level_wins[lvl][result['seating'][result['winner']]] += 1
+
+        # An AI seated twice plays the match once
+        for name in set(result['seating']):
+            stats[name]['matches'] += 1
+            if result['winner'] is None:
+                stats[name]['draws'] += 1
+            elif result['seating'][result['winner']] == name:
+                stats[name]['wins'] += 1
+
+        for i, name in enumerate(result['seating']):
+            stats[name]['kills'] += result['kills'][i]
+            stats[name]['deaths'] += result['total_deaths'][i]
+            for cause in game.DEATH_CAUSES:
+                stats[name]['causes'][cause] += result['deaths'][i][cause]
+
+    print_table('Results', ['AI', 'Matches', 'Wins', 'Draws', 'Kills', 'Deaths'] +
+            ['By ' + cause for cause in game.DEATH_CAUSES],
+            [[name, s['matches'], s['wins'], s['draws'], s['kills'], s['deaths']] +
+                [s['causes'][cause] for cause in game.DEATH_CAUSES]
+                for name, s in sorted(stats.items(), key=lambda i: -i[1]['wins'])])
+    print_table('Wins by level', ['Level'] + names + ['draw'],
+            [[lvl] + [wins[name] for name in names + ['draw']]
+                for lvl, wins in sorted(level_wins.items())])
+
+def main():
+    parser = argparse.ArgumentParser(description='Play every AI against every other on every level.')
+    parser.add_argument('--ai', nargs='+', choices=sorted(headless.ai_classes),
+            default=sorted(headless.ai_classes), help='AIs taking part')
+    parser.add_argument('--levels', nargs='+',
+            default=[lvl.config_file for lvl in level.get_levels()],
+            help='level files to play')
+    parser.add_argument('--seats', type=int, default=4,
+            help='players per match')
+    parser.add_argument('--rounds', type=int, default=1,
+            help='times each seating is played on each level')
+    parser.add_argument('--max-ticks', type=int, default=9000,
+            help='ticks before a match is called a draw')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+            help='worker processes')
+    parser.add_argument('--seed', type=int, default=0,
+            help='random seed of the first match, incremented for each match after it')
+    args = parser.parse_args()
+
+    schedule = [(level_file, seating, args.max_ticks)
+            for level_file in args.levels
+            for seating in get_seatings(args.ai, args.seats)
+            for i in range(args.rounds)]
+    schedule = [match + (args.seed + i,) for i, match in enumerate(schedule)]
+    print 'Playing %d matches on %d processes' % (len(schedule), args.processes)
+
+    start_time = time.time()
+    results = []
+    pool = multiprocessing.Pool(args.processes, silence_worker)
+    for result in pool.imap_unordered(play_match, schedule):
+        results.append(result)
+        sys.stdout.write('\r%d/%d matches' % (len(results), len(schedule)))
+        sys.stdout.flush()
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start_time
+    print '\n%d matches, %d ticks in %.1fs' % (len(results),
+            sum(r['ticks'] for r in results), elapsed)
+
+    summarize(results, args.ai)
+
+if __name__ == '__main__':
+    main()
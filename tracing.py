@@ -0,0 +1,104 @@
+""" A timeline of a game written as trace events, for looking at long runs
+    offline. The file is in the Trace Event Format, so it opens in
+    chrome://tracing or Perfetto.
+
+    Ticks, renders, each AI's execute and path searches are spans, and
+    collisions are instants. The game is traced on thread 0 and each AI on
+    the thread numbered after its seat. Events are gathered in batches and
+    written to the file by a background thread, so tracing costs the game
+    little more than making each event. Switched on with trace in
+    snake.ini, which sets game.tracer while a game is played; it is None
+    otherwise. AIs running in their own processes are not traced. """
+import json
+import os
+import Queue
+import threading
+import time
+from timeit import default_timer as clock
+
+import game
+
+class Tracer(object):
+    batch_size = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.start_time = clock()
+        self.events = []
+        self.batches = Queue.Queue()
+        self.writer = threading.Thread(target=self._write, name='trace writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def span(self, name, start, tid=0, args=None):
+        """ Records _name_ as lasting from _start_, a time from clock(),
+            until now. """
+        self._add(('X', name, start, clock() - start, tid, args))
+
+    def instant(self, name, tid=0, args=None):
+        self._add(('i', name, clock(), None, tid, args))
+
+    def name_thread(self, tid, name):
+        self._add(('M', 'thread_name', self.start_time, None, tid, {'name': name}))
+
+    def close(self):
+        """ Writes out the remaining events, and waits for the file to be
+            finished. """
+        self.batches.put(self.events)
+        self.batches.put(None)
+        self.events = []
+        self.writer.join()
+
+    def _add(self, event):
+        self.events.append(event)
+        if len(self.events) >= self.batch_size:
+            self.batches.put(self.events)
+            self.events = []
+
+    def _write(self):
+        with open(self.path, 'w') as f:
+            separator = '[\n'
+            while True:
+                events = self.batches.get()
+                if events is None:
+                    break
+                for phase, name, start, duration, tid, args in events:
+                    event = {'ph': phase, 'name': name, 'pid': self.pid, 'tid': tid,
+                            'ts': (start - self.start_time) * 1e6}
+                    if duration is not None:
+                        event['dur'] = duration * 1e6
+                    if phase == 'i':
+                        event['s'] = 't'
+                    if args is not None:
+                        event['args'] = args
+                    f.write(separator)
+                    f.write(json.dumps(event))
+                    separator = ',\n'
+            f.write('\n]\n' if separator != '[\n' else '[]\n')
+
+def start_tracing(directory='traces'):
+    """ Starts tracing to a new file in _directory_, and returns its name. """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    game.tracer = Tracer(path)
+    game.tracer.name_thread(0, 'game')
+    return path
+
+def stop_tracing():
+    """ Stops tracing and finishes the file, if tracing. """
+    tracer, game.tracer = game.tracer, None
+    if tracer is not None:
+        tracer.close()
+
+def traced_search(ai, search, *args):
+    """ Returns search(*args), an AI's path search, traced with the number
+        of nodes it expanded, which it counts in ai.nodes_expanded. """
+    if game.tracer is None:
+        return search(*args)
+    start = clock()
+    path = search(*args)
+    game.tracer.span('path search', start, ai.player_index + 1,
+            {'nodes expanded': ai.nodes_expanded, 'path length': len(path) if path else 0})
+    return path